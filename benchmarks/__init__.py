@@ -0,0 +1,5 @@
+"""
+Copyright (c) 2022-2023 Nanush7. See LICENSE file.
+
+Benchmarks of the modules, run from the repository root (e.g. python -m benchmarks.suite).
+"""
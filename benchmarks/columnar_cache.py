@@ -0,0 +1,46 @@
+"""
+Copyright (c) 2022-2023 Nanush7. See LICENSE file.
+
+Columnar cache benchmark: CSV parse vs cold (parse and write Feather) vs warm (memory-mapped Feather) loads.
+Requires pyarrow. Run from the repository root: python -m benchmarks.columnar_cache
+"""
+import random
+import tempfile
+from os import path
+from time import perf_counter
+from src import datastore
+from src.modules import survey_io
+from benchmarks.wide_loader import write_survey
+
+SHAPES = [(20_000, 300), (5_000, 1_000)]
+
+
+def timed(function):
+    start = perf_counter()
+    function()
+    return perf_counter() - start
+
+
+def main():
+    if datastore.get_feather() is None:
+        print('pyarrow is not installed.')
+        return
+
+    rnd = random.Random(0)
+    print(f'{"rows":>7} {"columns":>8} {"view":>9} {"CSV (s)":>8} {"cold (s)":>9} {"warm (s)":>9}')
+    with tempfile.TemporaryDirectory() as directory:
+        for rows, columns in SHAPES:
+            file_path = path.join(directory, f'survey_{rows}_{columns}.csv')
+            write_survey(file_path, columns, rows, rnd)
+            for dtype in (str, None):
+                cache_dir = path.join(directory, f'cache_{rows}_{columns}_{dtype}')
+                csv_time = timed(lambda: survey_io.read_survey(file_path, dtype=dtype))
+                # A new store each time, so only the on-disk cache is used.
+                cold_time = timed(lambda: datastore.DataStore(cache_dir=cache_dir).read(file_path, dtype=dtype))
+                warm_time = timed(lambda: datastore.DataStore(cache_dir=cache_dir).read(file_path, dtype=dtype))
+                view = 'str' if dtype is str else 'inferred'
+                print(f'{rows:>7} {columns:>8} {view:>9} {csv_time:>8.3f} {cold_time:>9.3f} {warm_time:>9.3f}')
+
+
+if __name__ == '__main__':
+    main()
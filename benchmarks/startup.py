@@ -0,0 +1,51 @@
+"""
+Copyright (c) 2022-2023 Nanush7. See LICENSE file.
+
+Startup benchmark: time from launching the suite to its main menu (target: under 200 ms),
+and the heavy dependencies imported by then.
+Run from the repository root: python -m benchmarks.startup
+"""
+import subprocess
+import sys
+import tempfile
+from os import path
+from statistics import median
+from time import perf_counter
+
+RUNS = 5
+TARGET_MS = 200
+HEAVY_MODULES = {'pandas', 'numpy', 'pyarrow', 'jinja2'}
+
+
+def launch(arguments, stdin=''):
+    """
+    :returns: (elapsed seconds, stderr)
+    """
+    start = perf_counter()
+    result = subprocess.run([sys.executable] + arguments, input=stdin, capture_output=True, text=True, check=True)
+    return perf_counter() - start, result.stderr
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        with open(path.join(directory, 'survey.csv'), 'w', encoding='utf-8') as f:
+            f.write('Question,\nResponse,Response\n1,2\n')
+        # The suite loads the modules, shows the main menu and exits.
+        suite = ['main.py', '-d', directory, '--no-colors']
+
+        interpreter = median(launch(['-c', 'pass'])[0] for _ in range(RUNS))
+        times = [launch(suite, '\nexit\n')[0] for _ in range(RUNS)]
+
+        # Top-level packages imported on the way to the menu.
+        _, importtime = launch(['-X', 'importtime'] + suite, '\nexit\n')
+        imported = {line.split('|')[-1].strip().split('.')[0] for line in importtime.splitlines()
+                    if line.startswith('import time:')}
+
+    elapsed = median(times)
+    print(f'Time to main menu: {elapsed * 1000:.1f} ms (median of {RUNS}, '
+          f'interpreter alone {interpreter * 1000:.1f} ms, target {TARGET_MS} ms)')
+    print(f'Heavy dependencies imported: {", ".join(sorted(HEAVY_MODULES & imported)) or "none"}')
+
+
+if __name__ == '__main__':
+    main()
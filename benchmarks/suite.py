@@ -0,0 +1,203 @@
+"""
+Copyright (c) 2022-2023 Nanush7. See LICENSE file.
+
+Benchmark suite of both modules on synthetic surveys (see benchmarks.surveys):
+module loading, Validator (list and delete modes) and Compiler (startup, topic detection and compile).
+Results are saved as JSON, so runs of different commits can be compared.
+
+Run from the repository root:
+    python -m benchmarks.suite --rows 1000 10000 --questions 50 --teams 13 -o results.json
+    python -m benchmarks.suite --compare old.json new.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from statistics import median
+from time import perf_counter
+from benchmarks.surveys import write_survey
+from src.datastore import DataStore
+from src.log import LogWrapper
+from src.metadata import metadata
+from src.modules import builder, survey_io
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(function, repeat: int, out: LogWrapper, rows: int = None, setup=None) -> dict:
+    """
+    Run function repeat times (calling setup before each run, untimed).
+    :returns: dict with the median seconds, rows/sec and the stage timings of the last run.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        out.stages = {}
+        with contextlib.redirect_stdout(io.StringIO()):  # Menus and colored messages.
+            start = perf_counter()
+            function()
+            times.append(perf_counter() - start)
+
+    result = {'seconds': round(median(times), 4)}
+    if rows:
+        result['rows_per_sec'] = round(rows / result['seconds'])
+    if out.stages:
+        result['stages'] = {name: round(seconds, 4) for name, (_, seconds, _, _) in out.stages.items()}
+    return result
+
+
+def load_modules():
+    """
+    Find the module files and load them (as selecting each module in the menu does).
+    :returns: dict[str, type]
+    """
+    builder._loaded.clear()
+    modules = {}
+    for info in builder._init():
+        modules[info.name] = info.load()
+    for module in builder.BaseModule.module_list:
+        modules[module.__name__] = module
+    return modules
+
+
+def get_teams(amount: int) -> list:
+    # Teams with topics first, the rest are skipped by the Compiler.
+    return sorted(metadata.TEAMS, key=lambda team: not metadata.TEAM_DEFAULT_INTEREST[team])[:amount]
+
+
+def run_size(rows: int, questions: int, teams: int, repeat: int) -> dict:
+    out = LogWrapper({'quiet': True, 'profile': True})
+    store = DataStore()
+    result = {'rows': rows, 'questions': questions, 'teams': teams}
+
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)  # Output directories are created here.
+        try:
+            survey_path, tokens_path = write_survey(directory, rows=rows, questions=questions)
+            files = [survey_io.SurveyFile(survey_path)]
+            result['columns'] = len(survey_io.read_header(survey_path))
+            result['file_mb'] = round(os.path.getsize(survey_path) / 2**20, 2)
+
+            modules = {}
+            result['module_loading'] = measure(lambda: modules.update(load_modules()), repeat, out)
+
+            # Validator.
+            validator = modules['Validator'](files=files, output=out, store=store)
+            validator.tokens_path = tokens_path
+            with contextlib.redirect_stdout(io.StringIO()):
+                validator.startup()
+            for mode in ('list', 'delete'):
+                result[f'validator_{mode}'] = measure(lambda: validator.validate_all(mode), repeat, out,
+                                                      rows=rows, setup=store.clear)
+            validator.close()
+
+            # Compiler.
+            compilers = []
+            result['compiler_startup'] = measure(
+                lambda: compilers.append(modules['Compiler'](files=files, output=out, store=store))
+                or compilers[-1].startup(), repeat, out, rows=rows, setup=store.clear)
+            compiler = compilers[-1]
+
+            def detect_topics():
+                compiler.question_index = {name: compiler.build_question_index(survey.columns)
+                                           for name, survey in compiler.dataframes.items()}
+                compiler.questions_by_survey = {name: compiler.get_topic_questions(name)
+                                                for name in compiler.dataframes}
+
+            result['compiler_topics'] = measure(detect_topics, repeat, out)
+            result['compiler_compile'] = measure(lambda: compiler.compile_all(get_teams(teams)), repeat, out,
+                                                 rows=rows)
+            for instance in compilers:
+                instance.close()
+        finally:
+            os.chdir(cwd)
+
+    return result
+
+
+def print_results(report: dict) -> None:
+    for result in report['results']:
+        print(f'\n{result["rows"]} rows, {result["questions"]} questions ({result["columns"]} columns, '
+              f'{result["file_mb"]} MB), {result["teams"]} teams:')
+        for name, value in result.items():
+            if isinstance(value, dict):
+                rate = f'{value["rows_per_sec"]:>10} rows/s' if 'rows_per_sec' in value else ''
+                print(f'    {name:<18} {value["seconds"]:>9.4f} s {rate}')
+
+
+def compare(old_path: str, new_path: str) -> None:
+    """
+    Print the ratio (new / old) of the seconds of each benchmark with the same sizes in both files.
+    """
+    reports = []
+    for file_path in (old_path, new_path):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            reports.append(json.load(f))
+    old, new = reports
+    print(f'{old.get("commit")} -> {new.get("commit")} (ratio > 1 is slower)')
+
+    old_results = {(r['rows'], r['questions'], r['teams']): r for r in old['results']}
+    for result in new['results']:
+        previous = old_results.get((result['rows'], result['questions'], result['teams']))
+        if previous is None:
+            continue
+        print(f'\n{result["rows"]} rows, {result["questions"]} questions, {result["teams"]} teams:')
+        for name, value in result.items():
+            if isinstance(value, dict) and name in previous:
+                before, after = previous[name]['seconds'], value['seconds']
+                ratio = after / before if before else float('inf')
+                print(f'    {name:<18} {before:>9.4f} s -> {after:>9.4f} s  x{ratio:.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the modules on synthetic surveys.')
+    parser.add_argument('--rows', help='Survey sizes (responses). Default: 1000 10000.', type=int, nargs='+',
+                        default=[1000, 10000])
+    parser.add_argument('--questions', help='Questions per survey. Default: 50.', type=int, default=50)
+    parser.add_argument('--teams', help=f'Teams/committees to compile. Default: {len(metadata.TEAMS)}.',
+                        type=int, default=len(metadata.TEAMS))
+    parser.add_argument('--repeat', help='Runs of each benchmark (the median is reported). Default: 3.',
+                        type=int, default=3)
+    parser.add_argument('-o', '--output', help='Write the results to this JSON file.', type=str, default=None)
+    parser.add_argument('--compare', help='Compare two JSON result files and exit.', nargs=2,
+                        metavar=('OLD', 'NEW'), default=None)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = {'commit': git_commit(),
+              'date': datetime.now().isoformat(timespec='seconds'),
+              'python': sys.version.split()[0],
+              'platform': platform.platform(),
+              'repeat': args.repeat,
+              'results': [run_size(rows, args.questions, args.teams, args.repeat) for rows in args.rows]}
+
+    print_results(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f'\nResults saved to {args.output}.')
+
+
+if __name__ == '__main__':
+    main()
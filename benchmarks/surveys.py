@@ -0,0 +1,101 @@
+"""
+Copyright (c) 2022-2023 Nanush7. See LICENSE file.
+
+Synthetic SurveyMonkey-style exports for the benchmarks.
+Surveys have the two header rows of the exports (question labels and sub-headers), the privacy columns,
+"N)" topic separator columns, questions with unnamed sub-columns (read by Pandas as "Unnamed: ..."),
+duplicated and invalid tokens, and the misplaced-token column at the end.
+Run from the repository root to write a survey: python -m benchmarks.surveys <directory> [rows] [questions]
+"""
+import csv
+import random
+import sys
+from os import path
+from src.metadata import metadata
+
+ANSWERS = ['', 'Yes', 'No', '1', '2', '3', '4', '5', 'Not sure', 'Great work, thanks!', 'a, b and c']
+
+
+def random_token(rnd) -> str:
+    return '%064x' % rnd.getrandbits(256)
+
+
+def survey_columns(questions: int, rnd):
+    """
+    Build the two header rows. Questions are spread over the topics of metadata.TOPIC_CODES,
+    the "Other Comments" topic (6) is a single question.
+    :returns: (labels, sub_headers)
+    """
+    labels = list(metadata.MUST_DELETE_COLUMNS)
+    sub_headers = [''] * len(labels)
+
+    topics = [code for code in metadata.TOPIC_CODES if code != '6']
+    for position, code in enumerate(topics):
+        labels.append(f'{code}) {metadata.SEPARATOR_QUESTION}')
+        sub_headers.append('Response')
+        for number in range(questions * position // len(topics), questions * (position + 1) // len(topics)):
+            labels.append(f'{code}.{number} {metadata.TOPIC_CODES[code]}: question {number}?')
+            sub_headers.append('Response')
+            # Multiple choice questions have one unnamed sub-column per option.
+            for option in range(rnd.choice([0, 0, 2, 4])):
+                labels.append('')
+                sub_headers.append(f'Option {option}')
+    labels.append(f'6) {metadata.TOPIC_CODES["6"]}')
+    sub_headers.append('Open-Ended Response')
+
+    # Misplaced-token column (no label).
+    labels.append('')
+    sub_headers.append('')
+    return labels, sub_headers
+
+
+def write_survey(directory: str, name: str = 'survey', rows: int = 1000, questions: int = 50,
+                 duplicates: float = 0.1, invalid: float = 0.05, misplaced: float = 0.02, seed: int = 0):
+    """
+    Write a survey CSV file and its tokens file.
+    duplicates, invalid and misplaced are the fractions of responses that reuse the token of an older response,
+    have a token that is not in the tokens file and have their token in the last column instead of wca_token.
+    :returns: (survey path, tokens path)
+    """
+    rnd = random.Random(seed)
+    labels, sub_headers = survey_columns(questions, rnd)
+    answer_columns = len(labels) - len(metadata.MUST_DELETE_COLUMNS) - 1
+
+    survey_path = path.join(directory, f'{name}.csv')
+    tokens_path = path.join(directory, f'{name}_tokens.txt')
+    tokens = []
+    with open(survey_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(labels)
+        writer.writerow(sub_headers)
+        for row in range(rows):
+            draw = rnd.random()
+            if draw < duplicates and tokens:
+                token = rnd.choice(tokens)
+            elif draw < duplicates + invalid:
+                token = random_token(rnd)
+            else:
+                token = random_token(rnd)
+                tokens.append(token)
+
+            bad_token = ''
+            if rnd.random() < misplaced:
+                token, bad_token = '', token
+
+            privacy = [str(10**9 + row), '400000000', '10/01/2023 10:00:00 AM', '10/01/2023 10:12:00 AM',
+                       '10.0.0.1', '', '', '', '', token]
+            writer.writerow(privacy + [rnd.choice(ANSWERS) for _ in range(answer_columns)] + [bad_token])
+
+    # Valid tokens of people that did not answer are in the file too.
+    tokens.extend(random_token(rnd) for _ in range(rows // 10))
+    rnd.shuffle(tokens)
+    with open(tokens_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(tokens) + '\n')
+
+    return survey_path, tokens_path
+
+
+if __name__ == '__main__':
+    print(write_survey(sys.argv[1],
+                       rows=int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+                       questions=int(sys.argv[3]) if len(sys.argv) > 3 else 50))
@@ -0,0 +1,80 @@
+"""
+Copyright (c) 2022-2023 Nanush7. See LICENSE file.
+
+Token index benchmark: lookup cost and startup (load) cost.
+Run from the repository root: python -m benchmarks.token_index
+"""
+import random
+import tempfile
+import tracemalloc
+from os import path
+from time import perf_counter
+from timeit import timeit
+import pandas
+from src.modules.tokens import TokenIndex, CompiledTokenIndex
+
+SIZES = [1_000, 10_000, 100_000]
+LOOKUPS = 1_000
+
+
+def random_tokens(amount, rnd):
+    return ['%064x' % rnd.getrandbits(256) for _ in range(amount)]
+
+
+def lookups(rnd):
+    print(f'{"tokens":>10} {"list (us/lookup)":>18} {"set (us/lookup)":>16} {"compiled (us/lookup)":>21}')
+    with tempfile.TemporaryDirectory() as directory:
+        for size in SIZES:
+            tokens = random_tokens(size, rnd)
+            tokens_path = path.join(directory, f'tokens_{size}.txt')
+            with open(tokens_path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(tokens))
+            index = TokenIndex(tokens)
+            compiled = CompiledTokenIndex.load(tokens_path)
+            # Half hits, half misses.
+            queries = rnd.sample(tokens, LOOKUPS // 2) + random_tokens(LOOKUPS // 2, rnd)
+            series = pandas.Series(queries)
+
+            list_time = timeit(lambda: [q in tokens for q in queries], number=1)
+            index_time = timeit(lambda: index.isin(series), number=20) / 20
+            compiled_time = timeit(lambda: compiled.isin(series), number=20) / 20
+            compiled.close()
+            print(f'{size:>10} {list_time / LOOKUPS * 1e6:>18.3f} {index_time / LOOKUPS * 1e6:>16.3f} '
+                  f'{compiled_time / LOOKUPS * 1e6:>21.3f}')
+
+
+def measure(loader):
+    tracemalloc.start()
+    start = perf_counter()
+    index = loader()
+    elapsed = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return index, elapsed, peak
+
+
+def startup(rnd):
+    size = SIZES[-1]
+    print(f'\nStartup with {size} tokens (Python heap peak, the compiled index is memory-mapped):')
+    with tempfile.TemporaryDirectory() as directory:
+        tokens_path = path.join(directory, 'tokens.txt')
+        with open(tokens_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(random_tokens(size, rnd)))
+
+        for label, loader in (('text file', lambda: TokenIndex.from_file(tokens_path)),
+                              ('compile (cold)', lambda: CompiledTokenIndex.load(tokens_path)),
+                              ('cached (warm)', lambda: CompiledTokenIndex.load(tokens_path))):
+            index, elapsed, peak = measure(loader)
+            print(f'{label:>16}: {elapsed * 1000:8.1f} ms {peak / 2**20:8.1f} MB')
+            if isinstance(index, CompiledTokenIndex):
+                index.close()
+
+
+def main():
+    rnd = random.Random(0)
+    lookups(rnd)
+    startup(rnd)
+
+
+if __name__ == '__main__':
+    main()
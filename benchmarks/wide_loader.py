@@ -0,0 +1,57 @@
+"""
+Copyright (c) 2022-2023 Nanush7. See LICENSE file.
+
+Wide survey loading benchmark: per-column str converters vs native string dtype.
+Run from the repository root: python -m benchmarks.wide_loader
+"""
+import csv
+import random
+import tempfile
+from os import path
+from time import perf_counter
+import pandas
+
+WIDTHS = [300, 1_000, 2_000]
+ROWS = 5_000
+OLD_MAX_COLUMNS = 400
+
+
+def write_survey(file_path, columns, rows, rnd):
+    with open(file_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([f'Question {i}' if i % 3 == 0 else '' for i in range(columns)])
+        writer.writerow(['Response'] * columns)
+        for _ in range(rows):
+            writer.writerow([rnd.choice(['', '1', '2.5', 'Yes', 'No']) for _ in range(columns)])
+
+
+def load_converters(file_path):
+    return pandas.read_csv(file_path, encoding='utf-8', converters={i: str for i in range(OLD_MAX_COLUMNS)})
+
+
+def load_native(file_path):
+    return pandas.read_csv(file_path, encoding='utf-8', dtype=str, na_filter=False)
+
+
+def timed(loader, file_path):
+    start = perf_counter()
+    df = loader(file_path)
+    return perf_counter() - start, df
+
+
+def main():
+    rnd = random.Random(0)
+    print(f'{"columns":>8} {"converters (s)":>15} {"native (s)":>11} {"non-str columns (converters)":>29}')
+    with tempfile.TemporaryDirectory() as directory:
+        for width in WIDTHS:
+            file_path = path.join(directory, f'wide_{width}.csv')
+            write_survey(file_path, width, ROWS, rnd)
+            old_time, old_df = timed(load_converters, file_path)
+            new_time, _ = timed(load_native, file_path)
+            # Columns past OLD_MAX_COLUMNS were silently parsed with type inference.
+            not_str = sum(1 for column in old_df.columns if old_df[column].map(type).ne(str).any())
+            print(f'{width:>8} {old_time:>15.3f} {new_time:>11.3f} {not_str:>29}')
+
+
+if __name__ == '__main__':
+    main()
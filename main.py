@@ -5,8 +5,11 @@ Copyright (c) 2022-2023 Nanush7. See LICENSE file.
 
 from src.log import LogWrapper
 from src.cli import CLI
+from src import batch
+from src.metadata import metadata
 
 import argparse
+import sys
 from os import path
 
 
@@ -21,6 +24,10 @@ def main():
 
     # Arguments.
     general.add_argument('-d', '--dir', help='Path to survey CSV directory.', type=str, default=None)
+    general.add_argument('--memory-cache', help='Memory limit (MB) of the parsed surveys cache. Default: 1024.',
+                         type=int, default=1024, dest='memory_cache')
+    general.add_argument('--cache-dir', help='Directory for columnar copies of the parsed surveys (requires pyarrow).',
+                         type=str, default=None, dest='cache_dir')
 
     log.add_argument(
         '-q', '--quiet', help='Do not log anything', action='store_true')
@@ -32,6 +39,48 @@ def main():
                      action='store_true', dest='log_file')
     log.add_argument('--no-colors', help='Disable colored logs',
                      action='store_false', dest='no_colors')
+    log.add_argument('--profile', help='Print the time, rows/sec and peak memory of each stage on exit',
+                     action='store_true')
+    log.add_argument('--profile-file', help='Also save cProfile stats to this file (implies --profile)',
+                     type=str, default=None, dest='profile_file')
+    log.add_argument('--log-queue', help='Write logs from a background thread (logging never blocks on output)',
+                     action='store_true', dest='log_queue')
+
+    # Headless commands (no prompts). Without a command, the interactive CLI is run.
+    commands = parser.add_subparsers(title='Headless commands', dest='command',
+                                     description='Run without prompts, print timings as JSON and exit.')
+    validate = commands.add_parser('validate', help='Validate the surveys.')
+    validate.add_argument('-t', '--tokens', help='Path to tokens file.', type=str, required=True)
+    validate.add_argument('-m', '--mode', help='delete: write Validated_*.csv files (default). '
+                                               'list: write Delete_*.txt files. '
+                                               'stream: like delete, reading the surveys in chunks. '
+                                               'incremental: like stream, only validating the responses added '
+                                               'since the last run.',
+                          choices=['delete', 'list', 'stream', 'incremental'], default='delete')
+    compile_ = commands.add_parser('compile', help='Compile the surveys for each team/committee.')
+    compile_.add_argument('--teams', help='Teams/committees to compile. Default: all.', nargs='+', default=None)
+    compile_.add_argument('-w', '--workers', help='Number of worker processes. Default: 1.', type=int, default=1)
+    pipeline = commands.add_parser('pipeline', help='Validate (delete mode) and compile the validated surveys in '
+                                                    'memory, without writing and parsing them again.')
+    pipeline.add_argument('-t', '--tokens', help='Path to tokens file.', type=str, required=True)
+    pipeline.add_argument('--teams', help='Teams/committees to compile. Default: all.', nargs='+', default=None)
+    pipeline.add_argument('-w', '--workers', help='Number of worker processes. Default: 1.', type=int, default=1)
+    pipeline.add_argument('--write-validated', help='Also write the Validated_*.csv files.', action='store_true',
+                          dest='write_validated')
+    watch = commands.add_parser('watch', help='Validate and compile new or changed surveys as they land in the '
+                                              'directory, until Ctrl-C is pressed.')
+    watch.add_argument('-t', '--tokens', help='Path to tokens file.', type=str, required=True)
+    watch.add_argument('-m', '--mode', help='Validation mode (see validate). Default: incremental.',
+                       choices=['delete', 'stream', 'incremental'], default='incremental')
+    watch.add_argument('--teams', help='Teams/committees to compile. Default: all.', nargs='+', default=None)
+    watch.add_argument('-w', '--workers', help='Number of worker processes. Default: 1.', type=int, default=1)
+    watch.add_argument('--no-compile', help='Only validate the surveys.', action='store_true', dest='no_compile')
+    watch.add_argument('--interval', help='Seconds between directory checks. Default: 2.', type=float, default=2.0)
+    watch.add_argument('--debounce', help='Seconds a file must stay unchanged before it is processed. Default: 1.',
+                       type=float, default=1.0)
+    for command in (validate, compile_, pipeline, watch):
+        command.add_argument('-r', '--report', help='Write the JSON timings to this file instead of stdout.',
+                             type=str, default=None)
 
     args = parser.parse_args()
 
@@ -40,21 +89,48 @@ def main():
         if not path.isdir(args.dir):
             parser.error('Directory not found.')
 
+    if args.memory_cache < 0:
+        parser.error('Memory cache size cannot be negative.')
+
     if args.quiet and args.verbose:
         parser.error('Cannot use quiet and verbose at the same time.')
 
+    if args.command and not args.dir:
+        parser.error('Headless commands require --dir.')
+
+    if args.command in ('validate', 'pipeline', 'watch') and not path.isfile(args.tokens):
+        parser.error('Tokens file not found.')
+
+    if args.command in ('compile', 'pipeline', 'watch'):
+        for team in args.teams or []:
+            if team not in metadata.TEAMS:
+                parser.error(f'Team not found: {team}.')
+        if args.workers < 1:
+            parser.error('Number of workers must be at least 1.')
+
+    if args.command == 'watch' and (args.interval <= 0 or args.debounce < 0):
+        parser.error('Watch interval must be positive and debounce cannot be negative.')
+
     # Log options.
     log_config = {
         'verbose': args.verbose,
         'no_warn': args.no_warn,
         'file': args.log_file,
         'colors': args.no_colors,
-        'quiet': args.quiet
+        'quiet': args.quiet,
+        'queue': args.log_queue,
+        'profile': args.profile or bool(args.profile_file),
+        'profile_file': args.profile_file
     }
     logger = LogWrapper(log_config)
 
-    cli_class = CLI(args.dir, logger)
-    cli_class.run()
+    try:
+        cli_class = CLI(args.dir, logger, args.memory_cache, args.cache_dir)
+        if args.command:
+            sys.exit(batch.run(cli_class, args))
+        cli_class.run()
+    finally:
+        logger.close()
 
 
 if __name__ == '__main__':
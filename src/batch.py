@@ -0,0 +1,163 @@
+"""
+Copyright (c) 2022-2023 Nanush7. See LICENSE file.
+
+Headless (non-interactive) runs of the modules.
+"""
+import json
+import sys
+from contextlib import redirect_stdout
+from time import perf_counter
+from src.modules import survey_io
+from src.modules.exceptions import ModuleError
+
+# Exit codes.
+EXIT_OK = 0
+EXIT_ERROR = 1
+
+
+def get_module(cli, name: str, **attributes):
+    """
+    Get a loaded module by name, set the given attributes (so startup does not prompt for them)
+    and run its startup if needed.
+    """
+    for index, module in enumerate(cli.modules):
+        if module.name == name:
+            module = cli.get_module(index)
+            break
+    else:
+        module = None
+    if module is None:
+        raise ModuleError(f'{name} module not loaded.')
+
+    for attribute, value in attributes.items():
+        setattr(module, attribute, value)
+    if not module.startup_completed:
+        if not module.startup():
+            raise ModuleError(f'{name} startup failed.')
+        module.startup_completed = True
+    return module
+
+
+def validate(cli, tokens_path: str, mode: str, files=None, write: bool = True) -> dict:
+    """
+    files: surveys to validate (list of SurveyFile). Default: every survey in the directory.
+    write: write the validated surveys (delete mode).
+    """
+    start = perf_counter()
+    validator = get_module(cli, 'Validator', tokens_path=tokens_path)
+    if files is not None:
+        validator.files = files
+    surveys = validator.validate_all(mode, write)
+    return {'step': 'validate', 'mode': mode, 'seconds': round(perf_counter() - start, 3), 'surveys': surveys}
+
+
+def compile_teams(cli, teams, workers: int, files=None, compiler=None) -> dict:
+    """
+    files: surveys to compile (list of SurveyFile). Default: every survey in the directory.
+    compiler: Compiler with its surveys already loaded (files is ignored).
+    """
+    start = perf_counter()
+    if compiler is None and files is None:
+        compiler = get_module(cli, 'Compiler')
+    elif compiler is None:
+        # Set before startup, so it does not load every survey in the directory (or reloaded if already started).
+        compiler = get_module(cli, 'Compiler', files=files)
+    timings = compiler.compile_all(teams, workers)
+    return {'step': 'compile', 'teams': teams or list(compiler.teams.keys()), 'workers': workers,
+            'seconds': round(perf_counter() - start, 3),
+            'surveys': [{'survey': title, 'seconds': seconds} for title, seconds in timings.items()],
+            'absent_columns': {title: compiler.absent_columns.get(title, []) for title in compiler.dataframes}}
+
+
+def pipeline(cli, tokens_path: str, teams, workers: int, write_validated: bool = False) -> list:
+    """
+    Validate the surveys (delete mode) and compile the validated DataFrames in the same process,
+    without writing and parsing the validated files again. The validated files are only written if
+    write_validated is True.
+    :returns: list[dict] with the validate and compile steps.
+    """
+    steps = [validate(cli, tokens_path, 'delete', write=write_validated)]
+
+    start = perf_counter()
+    validator = get_module(cli, 'Validator')
+    # Named as the validated files (the Compiler changes the frames in place), so the compiled files and reports
+    # are the same as compiling the validated files and never replace the ones of the original surveys.
+    dataframes = {validator.get_output_path(title): survey for title, survey in validator.dataframes.items()}
+    validator.dataframes = {}
+    compiler = get_module(cli, 'Compiler', files=[])  # Nothing to load from disk.
+    compiler.load_frames(dataframes)
+    step = compile_teams(cli, teams, workers, compiler=compiler)
+    step['seconds'] = round(perf_counter() - start, 3)
+    steps.append(step)
+    return steps
+
+
+def watch(cli, tokens_path: str, mode: str, teams=None, workers: int = 1, compile_surveys: bool = True,
+          interval: float = 2.0, debounce: float = 1.0) -> list:
+    """
+    Validate new or changed surveys as they land in the directory, and compile the validated files,
+    until Ctrl-C is pressed (see watch.Watcher).
+    :returns: list[dict] with the steps run for each group of files.
+    """
+    from src.watch import Watcher
+
+    # The files already processed are recorded next to the validated files and their checkpoints.
+    validator = get_module(cli, 'Validator', tokens_path=tokens_path)
+    state_path = f'{validator.VALIDATED_DIR}/watch_state.json'
+
+    def process(file_paths):
+        report = {'surveys': file_paths, 'status': 'ok', 'steps': []}
+        files = [survey_io.SurveyFile(file_path) for file_path in file_paths]
+        report['steps'].append(validate(cli, tokens_path, mode, files))
+        if compile_surveys:
+            validated = [survey_io.SurveyFile(validator.get_output_path(file_path)) for file_path in file_paths]
+            report['steps'].append(compile_teams(cli, teams, workers, validated))
+        return report
+
+    return Watcher(cli, process, interval, debounce, state_path).run()
+
+
+def run(cli, args) -> int:
+    """
+    Run a headless command and write the timings as JSON (to args.report, or stdout).
+    :returns: exit code.
+    """
+    report = {'command': args.command, 'status': 'ok', 'steps': []}
+    exit_code = EXIT_OK
+    start = perf_counter()
+
+    # Stdout only gets the report: menus, banners and other messages for people go to stderr.
+    stdout = sys.stdout
+    with redirect_stdout(sys.stderr):
+        cli.out.l_info('Loading modules...')
+        cli._load_modules()
+        try:
+            if args.command == 'validate':
+                report['steps'].append(validate(cli, args.tokens, args.mode))
+            elif args.command == 'compile':
+                report['steps'].append(compile_teams(cli, args.teams, args.workers))
+            elif args.command == 'pipeline':
+                report['steps'] = pipeline(cli, args.tokens, args.teams, args.workers, args.write_validated)
+            elif args.command == 'watch':
+                report['steps'] = watch(cli, args.tokens, args.mode, args.teams, args.workers, not args.no_compile,
+                                        args.interval, args.debounce)
+        except Exception as exc:
+            message = getattr(exc, 'message', None) or f'{type(exc).__name__}: {exc}'
+            cli.out.l_error(message)
+            report['status'] = 'error'
+            report['error'] = message
+            exit_code = EXIT_ERROR
+        finally:
+            for module in cli.modules:
+                if module.startup_completed:
+                    module.close()
+
+    report['seconds'] = round(perf_counter() - start, 3)
+    content = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            f.write(content + '\n')
+    else:
+        print(content, file=stdout)
+
+    return exit_code
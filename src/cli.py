@@ -3,7 +3,9 @@ Copyright (c) 2022-2023 Nanush7. See LICENSE file.
 """
 from os import path, listdir
 from random import randint
-from src.modules import builder
+from src.modules import builder, survey_io
+from src import batch
+from src.datastore import DataStore
 
 __version__ = '1.1.1'
 
@@ -13,11 +15,15 @@ class CLI:
     Interactive CLI Class.
     """
 
-    def __init__(self, directory, output):
+    def __init__(self, directory, output, memory_cache: int = 1024, cache_dir: str = None):
         self.out = output
         self.modules = []
         self.files = []
-        self._file_manager(directory)  # Open CSV files and save them to self.files.
+        self.directory = None
+        self.store = DataStore(memory_cache * 2**20, cache_dir)  # Parsed surveys, shared by all modules.
+        if cache_dir and not self.store.cache_dir:
+            self.out.l_warning('pyarrow is not installed, the columnar cache is disabled.')
+        self._file_manager(directory)  # Find CSV files and save them to self.files.
         self.main_menu = builder.Menu()
         self.mod_descriptions = []
         # Banner use only.
@@ -39,24 +45,76 @@ class CLI:
     def _load_modules(self):
         """
         Load modules.
+        Modules are only imported when selected (see get_module), unless their metadata cannot be read
+        from the file. Modules whose file did not change keep their instance (and its loaded data).
         """
+        previous = {type(instance): instance for instance in self.modules
+                    if not isinstance(instance, builder.LazyModule)}
         self.modules = []
+        self.mod_descriptions = []
         self.main_menu.remove_numbered_all()
-        builder._init()
+        infos = builder._init()
+
         for module in builder.BaseModule.module_list:
-            try:
-                instance = module(files=self.files, output=self.out)
+            if module in previous:
+                instance = previous.pop(module)
+                self.out.p_green(f'[OK] {instance.name} unchanged.')
+            else:
+                instance = self._instantiate(module)
+                if instance is None:
+                    continue
                 self.out.p_green(f'[OK] {instance.name} loaded.')
-            except Exception as exc:
-                self.out.l_warning(
-                    f'Could not import {module} ({exc})')
+            self.modules.append(instance)
+            self.main_menu.add_numbered_option(instance.name)
+
+        for info in infos:
+            module = info.loaded_class()
+            if module in previous:
+                instance = previous.pop(module)
+                self.out.p_green(f'[OK] {instance.name} unchanged.')
             else:
-                self.modules.append(instance)
-                self.main_menu.add_numbered_option(instance.name)
+                instance = builder.LazyModule(info)
+                self.out.p_green(f'[OK] {instance.name} found.')
+            self.modules.append(instance)
+            self.main_menu.add_numbered_option(instance.name)
+
+        # Close the instances of edited or removed modules.
+        for instance in previous.values():
+            if instance.startup_completed:
+                instance.close()
+
+    def _instantiate(self, module):
+        """
+        Create a module instance.
+        :returns: BaseModule | None if it fails.
+        """
+        try:
+            return module(files=self.files, output=self.out, store=self.store)
+        except Exception as exc:
+            self.out.l_warning(
+                f'Could not import {module} ({exc})')
+            return None
+
+    def get_module(self, index: int):
+        """
+        Get a module instance, importing the module first if it was not selected before.
+        :returns: BaseModule | None if it fails.
+        """
+        module = self.modules[index]
+        if isinstance(module, builder.LazyModule):
+            try:
+                module_class = module.load()
+            except Exception as exc:
+                self.out.l_warning(f'Could not import {module.name} ({exc})')
+                return None
+            module = self._instantiate(module_class)
+            if module is not None:
+                self.modules[index] = module
+        return module
 
     def _file_manager(self, directory=None):
         """
-        Open file, save it to self.file and change it in all modules.
+        Find the CSV files, save them to self.files and change them in all modules.
         """
         if not directory:  # Ask for dir path.
             print('Please, provide the absolute or relative path to the directory containing the CSV files.')
@@ -66,19 +124,59 @@ class CLI:
             self.out.l_error('Directory not found.')
             return
 
-        for file in self.files:  # Close files if already opened.
-            try:
-                file.close()
-            except AttributeError:
-                pass
-
-        self.files = []
-        for filename in listdir(directory):
-            if filename.endswith('.csv'):
-                self.files.append(open(f'{directory}/{filename}', 'r', encoding='utf-8'))
+        # Files are opened on demand by each reader.
+        self.directory = directory
+        self.files = [survey_io.SurveyFile(file_path) for file_path in CLI.list_surveys(directory)]
+        self.store.clear()
         for module in self.modules:
             module.files = self.files
 
+    @staticmethod
+    def list_surveys(directory: str) -> list:
+        """
+        :returns: list of the paths of the CSV files in the directory.
+        """
+        return [f'{directory}/{filename}' for filename in listdir(directory) if filename.endswith('.csv')]
+
+    def _get_tokens_path(self) -> str:
+        """
+        Get the tokens file of the Validator, or prompt for it if the Validator was not started.
+        """
+        for module in self.modules:
+            if module.name == 'Validator' and module.startup_completed:
+                return module.tokens_path
+        while True:
+            tokens_path = input('Path to tokens file: ')
+            if path.isfile(tokens_path):
+                return tokens_path
+            self.out.p_yellow('File not found, try again.')
+
+    def pipeline(self):
+        """
+        Validate (delete mode) and compile every team/committee, passing the validated surveys to the Compiler
+        in memory.
+        """
+        tokens_path = self._get_tokens_path()
+        write = builder.query_yes_no('Write the validated CSV files too?', default='no')
+        try:
+            batch.pipeline(self, tokens_path, None, 1, write)
+        finally:
+            # The Compiler was given the validated frames instead of the files.
+            for module in self.modules:
+                module.files = self.files
+
+    def watch(self):
+        """
+        Validate (incremental mode) and compile new or changed CSV files in the current directory until Ctrl-C.
+        """
+        tokens_path = self._get_tokens_path()
+        try:
+            batch.watch(self, tokens_path, 'incremental')
+        finally:
+            # The modules work on the whole directory again.
+            for module in self.modules:
+                module.files = self.files
+
     def menu(self) -> bool:
         # Print banner and options.
         self.out.clear()
@@ -111,7 +209,9 @@ class CLI:
             self._load_modules()
         elif choice:
             self.out.clear()
-            module = self.modules[int(choice) - 1]
+            module = self.get_module(int(choice) - 1)
+            if module is None:
+                return True
             # Don't run module if setup fails.
             if not module.startup_completed and module.startup():  # startup returns True if successful.
                 module.startup_completed = True
@@ -141,6 +241,9 @@ class CLI:
         self.main_menu.add_string_option('c', 'change the current directory.', self._file_manager)
         self.main_menu.add_string_option('d', 'write the description of each module')
         self.main_menu.add_string_option('r', 'reload modules')
+        self.main_menu.add_string_option('p', 'validate and compile the surveys in one pass', self.pipeline)
+        self.main_menu.add_string_option('w', 'watch the directory, validating and compiling new exports',
+                                         self.watch)
         self.main_menu.add_string_option('exit', 'close modules and exit')
 
         # Get modules.
@@ -154,9 +257,3 @@ class CLI:
                 input('\nPress enter to continue...')
         except KeyboardInterrupt:
             print('\nKeyboard interrupt caught! Closing...')
-        finally:
-            for file in self.files:
-                try:
-                    file.close()
-                except AttributeError:
-                    pass
@@ -0,0 +1,125 @@
+"""
+Copyright (c) 2022-2023 Nanush7. See LICENSE file.
+"""
+import os
+from collections import OrderedDict
+from glob import escape, glob
+from hashlib import sha256
+from src.modules import survey_io
+
+
+def get_feather():
+    """
+    Import pyarrow's Feather module (optional dependency, imported only if the columnar cache is used).
+    :returns: module | None if pyarrow is not installed.
+    """
+    try:
+        from pyarrow import feather
+    except ImportError:
+        return None
+    return feather
+
+
+class DataStore:
+    """
+    Session cache of parsed surveys, shared by all modules.
+    Each survey is parsed once per view (dtype and columns), keyed by path, size and modification time.
+    The least recently used frames are evicted when the cache grows over max_bytes.
+
+    If cache_dir is given (and pyarrow is installed), each view of a survey is also stored there in Feather
+    format (only the parsed columns: the Compiler's view has no privacy columns). Later sessions memory-map
+    that copy instead of parsing the CSV file, as long as its content hash is the same. The copy keeps
+    the Pandas column labels ("Unnamed: ..."), the modules use them to find the columns of each question.
+    """
+
+    def __init__(self, max_bytes: int = 1024 * 2**20, cache_dir: str = None):
+        self.max_bytes = max_bytes
+        self.feather = get_feather() if cache_dir else None
+        self.cache_dir = cache_dir if self.feather is not None else None
+        if self.cache_dir and not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self._frames = OrderedDict()
+        self._sizes = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self) -> int:
+        """
+        Memory used by the cached frames, in bytes.
+        """
+        return sum(self._sizes.values())
+
+    @staticmethod
+    def _key(file_path: str, dtype, usecols):
+        stat = os.stat(file_path)
+        usecols = tuple(usecols) if usecols is not None else None
+        return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, dtype, usecols
+
+    def read(self, file_path: str, dtype=None, usecols=None):
+        """
+        Get a survey DataFrame, parsing the file only if it is not cached.
+        Modules can modify the returned frame, it is a copy of the cached one.
+        :returns: pandas.DataFrame
+        """
+        key = DataStore._key(file_path, dtype, usecols)
+        if key in self._frames:
+            self.hits += 1
+            self._frames.move_to_end(key)
+            return self._frames[key].copy()
+
+        self.misses += 1
+        df = self._load(file_path, dtype, usecols)
+        self._frames[key] = df
+        self._sizes[key] = int(df.memory_usage(index=True, deep=True).sum())
+        self._evict()
+        return df.copy()
+
+    def _load(self, file_path: str, dtype, usecols):
+        """
+        Load a survey view from the columnar cache, or parse the CSV file and cache it.
+        :returns: pandas.DataFrame
+        """
+        if not self.cache_dir:
+            return survey_io.read_survey(file_path, dtype=dtype, usecols=usecols)
+
+        cache_path = self._cache_path(file_path, dtype, usecols)
+        if os.path.isfile(cache_path):
+            return self.feather.read_table(cache_path, memory_map=True).to_pandas()
+
+        df = survey_io.read_survey(file_path, dtype=dtype, usecols=usecols)
+        # Remove copies of older versions of the file, then write to a temporary file first.
+        for old_path in glob(self._cache_path(file_path, dtype, usecols, pattern=True)):
+            os.remove(old_path)
+        df.to_feather(cache_path + '.tmp')
+        os.replace(cache_path + '.tmp', cache_path)
+        return df
+
+    def _cache_path(self, file_path: str, dtype, usecols, pattern: bool = False) -> str:
+        """
+        Path of the columnar copy of a survey view: {name}-{content hash}-{view}.feather
+        The view is the dtype, followed by a hash of the column positions if only some columns are parsed.
+        If pattern is True, returns a glob pattern matching the copies of any content of the file instead.
+        """
+        view = 'str' if dtype is str else 'inferred'
+        if usecols is not None:
+            view += '-' + sha256(repr(list(usecols)).encode()).hexdigest()[:12]
+        prefix = os.path.join(self.cache_dir, os.path.basename(file_path))
+        if pattern:
+            # Only the hash is a wildcard, with its exact length: other surveys' names may start with this one.
+            return f'{escape(prefix)}-{"?" * 2 * sha256().digest_size}-{view}.feather'
+        return f'{prefix}-{survey_io.file_digest(file_path).hexdigest()}-{view}.feather'
+
+
+    def _evict(self) -> None:
+        """
+        Drop the least recently used frames until the cache fits in max_bytes.
+        The most recent frame is always kept.
+        """
+        while len(self._frames) > 1 and self.size > self.max_bytes:
+            key, _ = self._frames.popitem(last=False)
+            del self._sizes[key]
+
+    def clear(self) -> None:
+        self._frames.clear()
+        self._sizes.clear()
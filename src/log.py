@@ -2,7 +2,11 @@
 Copyright (c) 2022-2023 Nanush7. See LICENSE file.
 """
 import os
+import sys
 import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from time import monotonic, perf_counter
 from colorama import Fore, Back, init
 
 
@@ -16,6 +20,18 @@ class LogWrapper:
         self.file = config.get('file', False)
         self.colors = config.get('colors', True)
         self.enabled = not config.get('quiet', False)
+        self.use_queue = config.get('queue', False)
+        self.listener = None
+
+        # Profiling (see stage).
+        self.profile = config.get('profile', False)
+        self.profile_file = config.get('profile_file', None)
+        self.stages = {}  # Stage name -> [calls, seconds, rows, process peak RSS (MB)].
+        self.profiler = None
+        if self.profile_file:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
 
         # Get new logger.
         self.logger = logging.getLogger('main_logger')
@@ -25,12 +41,13 @@ class LogWrapper:
             '[%(module)s][%(levelname)s] %(message)s')
 
         if self.enabled:
+            handlers = []
             # File Handler.
             if self.file:
                 fh = logging.FileHandler('output.log')
                 fh.setLevel(logging.DEBUG)
                 fh.setFormatter(formatter)
-                self.logger.addHandler(fh)
+                handlers.append(fh)
 
             # Console Handler.
             if self.colors:
@@ -40,11 +57,31 @@ class LogWrapper:
             ch = logging.StreamHandler()
             ch.setLevel(logging.DEBUG)
             ch.setFormatter(formatter)
-            self.logger.addHandler(ch)
+            handlers.append(ch)
+
+            if self.use_queue:
+                # Records are written by the listener thread, so logging never waits for the terminal or the disk.
+                log_queue = SimpleQueue()
+                self.logger.addHandler(QueueHandler(log_queue))
+                self.listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+                self.listener.start()
+            else:
+                for handler in handlers:
+                    self.logger.addHandler(handler)
 
         else:
             self.logger.disabled = True
 
+    def close(self) -> None:
+        """
+        Print the profile (if enabled), write the queued records (queue mode) and stop the listener thread.
+        """
+        if self.profile:
+            self.print_profile()
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+
     def clear(self) -> None:
         """
         Clear console screen.
@@ -76,6 +113,55 @@ class LogWrapper:
         """Log errors."""
         self.logger.error(message)
 
+    def l_rows(self, summary, sample=10, interval=None, verbose=False):
+        """
+        Get a RowLog to log messages about many rows (see RowLog).
+        verbose: log with l_verbose instead of l_info.
+        """
+        if verbose:
+            return RowLog(self.l_verbose, summary, sample, interval, enabled=self.enabled and self.verbose)
+        return RowLog(self.l_info, summary, sample, interval, enabled=self.enabled)
+
+    #############
+    # Profiling #
+    #############
+
+    def stage(self, name, rows=None):
+        """
+        Time a stage of a run (only if profiling is enabled, otherwise it does nothing).
+        The number of rows processed can be given here or set on the returned object.
+
+        Usage:
+            with self.out.stage('CSV write', rows=len(df)):
+                ...
+        """
+        if not self.profile:
+            return _NO_STAGE
+        return _Stage(self.stages, name, rows)
+
+    def print_profile(self) -> None:
+        """
+        Print the wall time and throughput of each stage, and dump the cProfile stats.
+        The RSS column is the peak of the whole process when the stage last ended (ru_maxrss never goes down),
+        a stage only used that much memory if the value grew after the previous stages.
+        Printed to stderr, as the log messages, so it does not mix with the reports of headless runs.
+        """
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_file)
+            self.profiler = None
+
+        if self.stages:
+            width = max(len(name) for name in self.stages)
+            print(f'\n{"Stage":<{width}} {"calls":>6} {"seconds":>9} {"rows/sec":>11} {"process peak RSS (MB)":>22}',
+                  file=sys.stderr)
+            for name, (calls, seconds, rows, peak_rss) in self.stages.items():
+                rate = f'{rows / seconds:.0f}' if rows and seconds else '-'
+                print(f'{name:<{width}} {calls:>6} {seconds:>9.3f} {rate:>11} {peak_rss:>22}', file=sys.stderr)
+            self.stages = {}
+        if self.profile_file:
+            print(f'cProfile stats saved to {self.profile_file}.', file=sys.stderr)
+
     #####################
     # Print with colors #
     #####################
@@ -99,16 +185,128 @@ class _CustomFormatter(logging.Formatter):
     yellow = Fore.YELLOW
     red = Fore.RED
     reset = Fore.RESET + Back.RESET
-    format = "[%(levelname)s] %(message)s"
+    format_string = "[%(levelname)s] %(message)s"
 
     FORMATS = {
-        logging.INFO: format,
-        logging.DEBUG: format,
-        logging.WARNING: yellow + format + reset,
-        logging.ERROR: red + format + reset,
+        logging.INFO: format_string,
+        logging.DEBUG: format_string,
+        logging.WARNING: yellow + format_string + reset,
+        logging.ERROR: red + format_string + reset,
     }
 
+    def __init__(self):
+        super().__init__(self.format_string)
+        # Built once, not for every record.
+        self.formatters = {level: logging.Formatter(log_fmt) for level, log_fmt in self.FORMATS.items()}
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
+        formatter = self.formatters.get(record.levelno)
+        if formatter is None:
+            return super().format(record)
         return formatter.format(record)
+
+
+class RowLog:
+    """
+    Aggregated logging for loops over many rows.
+    Only the first `sample` messages are logged, the rest are counted and summarized when the RowLog is closed:
+    "... and N more {summary}.". If interval (seconds) is given, the count so far is also logged at most once
+    per interval. Messages use %-style arguments, which are only formatted if the message is logged.
+
+    Usage:
+        with logger.l_rows('invalid tokens') as rows:
+            for index in indexes:
+                rows.add('#%s >> Invalid token', index)
+    """
+
+    def __init__(self, log, summary, sample=10, interval=None, enabled=True):
+        self.log = log
+        self.summary = summary
+        self.sample = sample
+        self.interval = interval
+        self.enabled = enabled
+        self.logged = 0
+        self.skipped = 0
+        self._last = monotonic()
+
+    def add(self, message, *args) -> None:
+        if self.logged < self.sample:
+            self.logged += 1
+            if self.enabled:
+                self.log(message % args if args else message)
+            return
+        self.skipped += 1
+        if self.interval is not None and self.enabled and monotonic() - self._last >= self.interval:
+            self._last = monotonic()
+            self.log(f'... {self.skipped} more {self.summary} so far.')
+
+    def add_all(self, message, values) -> None:
+        """
+        Add one message per value (message % value). Values past the sample are only counted.
+        """
+        free = max(self.sample - self.logged, 0)
+        for value in values[:free]:
+            self.add(message, value)
+        if len(values) > free:
+            self.skipped += len(values) - free
+
+    def close(self) -> None:
+        if self.skipped and self.enabled:
+            self.log(f'... and {self.skipped} more {self.summary}.')
+        self.skipped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _Stage:
+    """Timer of a profiled stage (see LogWrapper.stage)."""
+
+    def __init__(self, stages, name, rows=None):
+        self.stages = stages
+        self.name = name
+        self.rows = rows
+        self.start = None
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        from resource import getrusage, RUSAGE_SELF
+        elapsed = perf_counter() - self.start
+        stats = self.stages.setdefault(self.name, [0, 0.0, 0, 0])
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] += self.rows or 0
+        stats[3] = getrusage(RUSAGE_SELF).ru_maxrss // 1024
+
+
+class _NoStage:
+    """Stage used when profiling is disabled."""
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def resident_memory():
+    """
+    Current resident memory of the process in MB (read from /proc, so only on Linux).
+    :returns: int | None if it cannot be read.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') // 2**20
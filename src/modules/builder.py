@@ -2,7 +2,9 @@
 Copyright (c) 2022-2023 Nanush7. See LICENSE file.
 """
 import abc
+import ast
 import os
+from hashlib import sha256
 from importlib import util
 from prettytable import PrettyTable
 from src.modules.exceptions import ModuleError
@@ -32,6 +34,10 @@ class BaseModule(metaclass=abc.ABCMeta):
         self._authors = authors
         self._files = kwargs['files']
         self.out = kwargs['output']
+        self.store = kwargs.get('store')  # Session DataStore, shared by all modules.
+        if self.store is None:
+            from src.datastore import DataStore
+            self.store = DataStore()
         self.startup_completed = False
 
     @property
@@ -52,14 +58,13 @@ class BaseModule(metaclass=abc.ABCMeta):
 
     @property
     def files(self):
-        for file in self._files:
-            file.seek(0)  # Pandas problem workaround.
+        """
+        Survey files (survey_io.SurveyFile descriptors).
+        """
         return self._files
 
     @files.setter
     def files(self, value):
-        for file in value:
-            file.seek(0)  # Pandas problem workaround.
         self.on_file_change(value)
         self._files = value
 
@@ -91,6 +96,76 @@ class BaseModule(metaclass=abc.ABCMeta):
         pass
 
 
+class ModuleInfo:
+    """
+    Module metadata, read from the module file without importing it.
+    """
+    def __init__(self, path, class_name, name, description, version, authors=None):
+        self.path = path
+        self.class_name = class_name
+        self.name = name
+        self.description = description
+        self.version = version
+        self.authors = authors
+
+    def loaded_class(self):
+        """
+        Get the module class if its file is already loaded (and unchanged), without loading it.
+        """
+        if self.path in _loaded:
+            return self._find(_loaded[self.path][2])
+        return None
+
+    def load(self):
+        """
+        Load the module file (with its imports) and get the module class.
+        Raises: ModuleError if the class is not found.
+        """
+        module_class = self._find(_load_file(self.path))
+        if module_class is None:
+            raise ModuleError(f'{self.class_name} not found in {self.path}.')
+        return module_class
+
+    def _find(self, classes):
+        for module_class in classes:
+            if module_class.__name__ == self.class_name:
+                return module_class
+        return None
+
+
+class LazyModule:
+    """
+    Placeholder of a module that was not selected yet.
+    It has the same metadata as the module, the module itself is loaded with load().
+    """
+    startup_completed = False
+
+    def __init__(self, info: ModuleInfo):
+        self.info = info
+
+    @property
+    def name(self):
+        return self.info.name
+
+    @property
+    def description(self):
+        return self.info.description
+
+    @property
+    def version(self):
+        return self.info.version
+
+    @property
+    def authors(self):
+        return self.info.authors
+
+    def load(self):
+        """
+        :returns: The module class.
+        """
+        return self.info.load()
+
+
 ###################
 # Interface utils #
 ###################
@@ -325,6 +400,13 @@ def query_yes_no(question, default=None) -> bool:
 # Internal use #
 ################
 
+# Loaded module files: path -> (modification time, content hash, module classes).
+_loaded = {}
+
+# Metadata arguments every module sets in its __init__.
+_METADATA = ('name', 'description', 'version', 'authors')
+
+
 def _load_module(path):
     name = os.path.split(path)[-1]
     spec = util.spec_from_file_location(name, path)
@@ -333,11 +415,103 @@ def _load_module(path):
     return module
 
 
-def _init():
+def _load_file(path) -> list:
+    """
+    Execute a module file, unless it is already loaded.
+    :returns: list of module classes defined in the file.
+    """
+    if path not in _loaded:
+        # Classes register themselves in module_list when the file is executed.
+        start = len(BaseModule.module_list)
+        _load_module(path)
+        _loaded[path] = (os.stat(path).st_mtime_ns, _file_hash(path), BaseModule.module_list[start:])
+    return _loaded[path][2]
+
+
+def _file_hash(path) -> str:
+    with open(path, 'rb') as f:
+        return sha256(f.read()).hexdigest()
+
+
+def _refresh(path) -> None:
+    """
+    Forget a loaded file if its content changed, so it is executed again on the next load.
+    The content is checked only if the modification time changed.
+    """
+    cached = _loaded.get(path)
+    if not cached:
+        return
+    mtime = os.stat(path).st_mtime_ns
+    if cached[0] == mtime:
+        return
+    if cached[1] == _file_hash(path):
+        _loaded[path] = (mtime, cached[1], cached[2])
+    else:
+        del _loaded[path]
+
+
+def _read_info(path):
+    """
+    Read the metadata of the module classes in a file without executing it.
+    :returns: list[ModuleInfo] | None if the metadata is not set with literal values in __init__.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    infos = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        base_names = [getattr(base, 'attr', getattr(base, 'id', None)) for base in node.bases]
+        if 'BaseModule' not in base_names:
+            continue
+
+        metadata = {}
+        for item in node.body:
+            if isinstance(item, ast.FunctionDef) and item.name == '__init__':
+                for statement in item.body:
+                    if isinstance(statement, ast.Assign) and len(statement.targets) == 1 \
+                            and isinstance(statement.targets[0], ast.Name) \
+                            and statement.targets[0].id in _METADATA:
+                        try:
+                            metadata[statement.targets[0].id] = ast.literal_eval(statement.value)
+                        except ValueError:
+                            return None
+        if set(metadata) != set(_METADATA):
+            return None
+        infos.append(ModuleInfo(path, node.name, **metadata))
+
+    return infos
+
+
+def _init() -> list:
+    """
+    Find the module files. Files whose metadata can be read without executing them are not loaded,
+    their ModuleInfo is returned instead. Other files are loaded and their classes added to module_list.
+    Files that did not change since they were loaded keep their classes, edited files are executed again.
+    :returns: list[ModuleInfo]
+    """
     BaseModule.module_list = []
     path = os.path.abspath(__file__)
     dirpath = os.path.dirname(path)
 
+    infos = []
+    found = set()
     for file_name in os.listdir(dirpath):
-        if file_name.endswith('_module.py'):
-            _load_module(os.path.join(dirpath, file_name))
+        if not file_name.endswith('_module.py'):
+            continue
+        file_path = os.path.join(dirpath, file_name)
+        found.add(file_path)
+        _refresh(file_path)
+
+        file_infos = _read_info(file_path)
+        if file_infos is None:
+            BaseModule.module_list.extend(_load_file(file_path))
+        else:
+            infos.extend(file_infos)
+
+    # Forget removed files.
+    for file_path in set(_loaded) - found:
+        del _loaded[file_path]
+
+    return infos
@@ -0,0 +1,46 @@
+"""
+Copyright (c) 2022-2023 Nanush7. See LICENSE file.
+
+Process pool used by the Compiler to write the compiled surveys in parallel.
+Jobs live here because module files are not importable by the worker processes.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from src.modules import survey_io
+
+# Read-only survey snapshot of each worker process.
+_surveys = {}
+
+
+def _init_worker(surveys) -> None:
+    global _surveys
+    _surveys = surveys
+
+
+def compile_job(title: str, columns, output_path: str) -> str:
+    """
+    Slice the survey columns and write the compiled CSV file.
+    :returns: output_path
+    """
+    survey_io.write_csv(_surveys[title].iloc[:, list(columns)], output_path)
+    return output_path
+
+
+def get_pool(surveys: dict, workers: int) -> ProcessPoolExecutor:
+    """
+    Create a process pool whose workers can read the given surveys.
+    Forked workers share the parent's DataFrames (copy-on-write), otherwise they are sent once to each worker.
+    """
+    global _surveys
+    if 'fork' in multiprocessing.get_all_start_methods():
+        _surveys = surveys
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(surveys,))
+
+
+def release() -> None:
+    """
+    Drop the parent's reference to the surveys once the pool is closed.
+    """
+    global _surveys
+    _surveys = {}
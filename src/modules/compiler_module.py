@@ -1,16 +1,16 @@
 """
 Compiler Module.
 """
-import pandas
-from re import search, sub
-from os import path, makedirs
+from re import search
+from os import path, makedirs, cpu_count
 from datetime import datetime
-from jinja2 import Environment, FileSystemLoader
-from src.modules import builder, exceptions
+from time import perf_counter
+from src.modules import builder, exceptions, survey_io, compile_pool
 from src.metadata import metadata
 
 
 COMPILED_DIR = 'Compiled'
+METADATA_DIR = path.dirname(metadata.__file__)  # Templates and scheme.
 
 
 class Compiler(builder.BaseModule):
@@ -31,7 +31,9 @@ class Compiler(builder.BaseModule):
         self.team_topics = metadata.TEAM_DEFAULT_INTEREST
         self.team_columns = {}
         self.must_delete_columns = metadata.MUST_DELETE_COLUMNS
+        self.absent_columns = {}  # Survey title -> privacy columns (must_delete_columns) not found in it.
         self.questions_by_survey = {}
+        self.question_index = {}
         self.dataframes = {}
 
         # Menus.
@@ -42,13 +44,17 @@ class Compiler(builder.BaseModule):
         # Tables.
         self.topics_table = builder.Table(['Code', 'Description'])
 
-        # Jinja2 scheme template.
-        self.jinja = Environment(loader=FileSystemLoader('src/metadata/'))
+        # Jinja2 templates environment (created when a template is first rendered).
+        self._jinja = None
 
-    def startup(self) -> bool:
-        # Pandas DataFrames.
-        self.dataframes = Compiler.get_dataframes(self.files)
+    @property
+    def jinja(self):
+        if self._jinja is None:
+            from jinja2 import Environment, FileSystemLoader
+            self._jinja = Environment(loader=FileSystemLoader(METADATA_DIR))
+        return self._jinja
 
+    def startup(self) -> bool:
         # Topics table.
         for code, description in self.topic_codes.items():
             self.topics_table.add_row([code, description])
@@ -58,6 +64,10 @@ class Compiler(builder.BaseModule):
         self.main_menu.add_numbered_option('Set topics by team/committee.', callback=self.set_interests)
         self.main_menu.add_numbered_option('Generate scheme.', callback=self.generate_scheme_file)
         self.main_menu.add_string_option('compile', 'compile questions for a team/committee.', callback=self.compile)
+        self.main_menu.add_string_option('all', 'compile questions for every team/committee.',
+                                         callback=self.compile_all)
+        self.main_menu.add_string_option('parallel', 'compile questions for every team/committee using '
+                                                     'multiple processes.', callback=self.compile_parallel)
 
         # Try to import scheme.
         try:
@@ -73,19 +83,8 @@ class Compiler(builder.BaseModule):
         self.interests_menu.add_string_option('codes', 'display topic codes.')
         self.interests_menu.add_string_option('list', 'display topics by team.')
 
-        # Drop unwanted columns.
-        self.out.l_info('Dropping unwanted columns...')
-        for survey in self.dataframes.values():
-            for column_label in self.must_delete_columns:
-                try:
-                    survey.drop(column_label, axis=1, inplace=True)
-                except KeyError:
-                    self.out.l_warning(f'{column_label} not found. Skipped.')
-
-        # Get questions by topic for each survey.
-        if not self.questions_by_survey:
-            for name, survey in self.dataframes.items():
-                self.questions_by_survey[name] = self.get_topic_questions(survey)
+        # Pandas DataFrames.
+        self.load_surveys(self.files)
 
         # Create CSV output directory.
         if not path.exists(COMPILED_DIR):
@@ -93,15 +92,87 @@ class Compiler(builder.BaseModule):
 
         return True
 
-    @staticmethod
-    def get_dataframes(files):
+    def load_surveys(self, files) -> None:
+        """
+        Load the surveys without the unwanted columns (they are skipped while parsing) and index their questions.
+        """
+        self.load_frames(self.get_dataframes(files), drop_columns=False)
+
+    def load_frames(self, dataframes: dict, drop_columns: bool = True) -> None:
+        """
+        Use already loaded surveys (e.g. validated by the Validator), dropping unwanted columns (in place)
+        and indexing their questions.
+        dataframes: dict[str, pandas.DataFrame] (survey title -> survey).
+        drop_columns: False if the unwanted columns were not loaded.
+        """
+        self.dataframes = dataframes
+
+        # Drop unwanted columns.
+        if drop_columns:
+            self.out.l_info('Dropping unwanted columns...')
+            for name, survey in self.dataframes.items():
+                with self.out.stage('drop columns', rows=len(survey)):
+                    present = self.find_unwanted_columns(name, survey.columns)
+                    survey.drop(columns=[survey.columns[position] for position in present], inplace=True)
+
+        with self.out.stage('topic detection'):
+            # Column ranges of each question.
+            self.question_index = {name: Compiler.build_question_index(survey.columns)
+                                   for name, survey in self.dataframes.items()}
+
+            # Get questions by topic for each survey (unless they were imported from the scheme).
+            for name in self.dataframes:
+                if name not in self.questions_by_survey:
+                    self.questions_by_survey[name] = self.get_topic_questions(name)
+
+    def get_dataframes(self, files):
+        """
+        Load the surveys, parsing every column except the unwanted ones (privacy data never gets loaded).
+        """
+        self.out.l_info('Loading surveys without unwanted columns...')
         df = {}
         for file in files:
-            df[file.name] = pandas.read_csv(file, encoding='utf-8')
+            columns = survey_io.read_header(file.name)
+            unwanted = set(self.find_unwanted_columns(file.name, columns))
+            usecols = [position for position in range(len(columns)) if position not in unwanted]
+            with self.out.stage('load') as stage:
+                df[file.name] = self.store.read(file.name, usecols=usecols)
+                stage.rows = len(df[file.name])
 
         return df
 
-    def get_topic_questions(self, survey):
+    def find_unwanted_columns(self, title: str, columns) -> list:
+        """
+        Find the positions of the unwanted (privacy) columns in a survey, recording and reporting
+        the ones that are not in it.
+        :returns: list[int]
+        """
+        positions = {label: position for position, label in enumerate(columns)}
+        self.absent_columns[title] = [label for label in self.must_delete_columns if label not in positions]
+        if self.absent_columns[title]:
+            self.out.l_warning(f'Not found in {title} (skipped): {", ".join(self.absent_columns[title])}.')
+        return [positions[label] for label in self.must_delete_columns if label in positions]
+
+    @staticmethod
+    def build_question_index(columns):
+        """
+        Map each question to its column range, including the "Unnamed: ..." sub-columns that follow it.
+        :returns: dict[str, tuple[int, int]]
+        """
+        index = {}
+        start = None
+        for position, column_label in enumerate(columns):
+            if metadata.PANDAS_UNNAMED in column_label:
+                continue
+            if start is not None:
+                index.setdefault(columns[start], (start, position))
+            start = position
+        if start is not None:
+            index.setdefault(columns[start], (start, len(columns)))
+
+        return index
+
+    def get_topic_questions(self, title: str):
         """
         Get questions by topic.
         :returns: dict[str, list[str]]
@@ -110,40 +181,29 @@ class Compiler(builder.BaseModule):
         topic = '0'
         for code in self.topic_codes.keys():
             questions[code] = []
-        for index, column_label in enumerate(survey.columns):
+        for column_label in self.question_index[title]:
             match = search(r'^\d+\)', column_label)  # Search for "number)".
             if match and match.group()[:-1] == '6':  # TODO: Abstract "Other Comments" code. Edge case.
                 topic = '6'
                 questions[topic].append(column_label)
             elif match:
                 topic = match.group()[:-1]  # [:-1] removes the parenthesis from the matched code.
-            elif metadata.PANDAS_UNNAMED not in column_label:
+            else:
                 questions[topic].append(column_label)
 
         return questions
 
-    def get_question_range(self, survey, question: str):
+    def get_question_range(self, title: str, question: str):
         """
         Get question column range.
         :returns: tuple[int, int]
         """
-        start = None
-        end = None
-        columns = survey.columns
-        for index, column_label in enumerate(columns):
-            if column_label == question:
-                start = index
-                end = start + 1
-                while end < len(columns) and metadata.PANDAS_UNNAMED in columns[end]:
-                    end += 1
-                break
-
-        if start is None or end is None:
+        try:
+            return self.question_index[title][question]
+        except KeyError:
             self.out.l_error('Critical error.')
             raise exceptions.ModuleError('Critical error trying to locate question. Please, open an issue.')
 
-        return start, end
-
     def get_interests_table(self):
         """
         Topics by team.
@@ -174,7 +234,7 @@ class Compiler(builder.BaseModule):
                                  teams=self.team_topics,
                                  surveys=self.questions_by_survey)
 
-        with open('src/metadata/scheme.py', 'w', encoding='utf-8') as f:
+        with open(path.join(METADATA_DIR, 'scheme.py'), 'w', encoding='utf-8') as f:
             f.write(scheme)
         self.out.p_green('scheme.py generated successfully.')
 
@@ -255,47 +315,157 @@ class Compiler(builder.BaseModule):
             # Compile.
             self.out.clear()
             self.out.l_info(f'Compiling {len(all_questions)} questions...')
-            question_indexes = []
-            for question in all_questions:
-                question_range = self.get_question_range(survey, question)
-                question_indexes.extend([*range(question_range[0], question_range[1])])
+            with self.out.stage('range resolution'):
+                columns = self.get_question_columns(title, all_questions)
+            with self.out.stage('slicing', rows=len(survey)):
+                compiled_df = survey.iloc[:, columns]
+            self.save_compiled(team, title, compiled_df, len(survey) - 1, team_questions, additional_questions)
+            self.out.p_green(f'{title} compiled successfully!')
 
-            compiled_df = survey.iloc[:, question_indexes]
+        self.out.p_green('All surveys compiled successfully!')
+
+    def compile_all(self, teams=None, workers: int = 1):
+        """
+        Compile the questions of every team/committee (or only the given ones) based on their topics,
+        in a single pass over each survey.
+        With more than one worker, the (survey, team) jobs are sent to a process pool.
+        :returns: dict[str, float] with the seconds taken by each survey.
+        """
+        teams = teams or list(self.teams.keys())
+        if workers > 1:
+            return self.compile_parallel(teams, workers)
 
-            # Save to file.
-            filename = f'{team}_{title.split("/")[-1]}'
-            compiled_df.to_csv(f'{COMPILED_DIR}/{filename}', sep=',', index=False, encoding='utf-8')
+        timings = {}
+        for title, survey in self.dataframes.items():
+            start = perf_counter()
+            self.out.p_green(f'\nCompiling {title} for {len(teams)} teams/committees...\n')
 
-            # Remove "Unnamed: ..." from column headers.
-            with open(f'{COMPILED_DIR}/{filename}', 'r', encoding='utf-8') as f:
-                content = f.read()
+            # Teams with the same topics share the same slice.
+            compiled = {}
+            for team, columns, team_questions in self.get_team_jobs(title, teams):
+                if columns not in compiled:
+                    with self.out.stage('slicing', rows=len(survey)):
+                        compiled[columns] = survey.iloc[:, list(columns)]
+                self.save_compiled(team, title, compiled[columns], len(survey) - 1, team_questions, [])
 
-            content = sub(r'(Unnamed: )[0-9]+', '', content)
+            timings[title] = round(perf_counter() - start, 3)
+            self.out.l_info(f'{title} compiled in {timings[title]:.2f} s.')
 
-            # Write fixed content.
-            with open(f'{COMPILED_DIR}/{filename}', 'w', encoding='utf-8') as f:
-                f.write(content)
+        self.out.p_green('All surveys compiled successfully!')
+        return timings
 
-            self.out.l_info(f'Compiled CSV saved to {COMPILED_DIR}/{filename}.')
+    def compile_parallel(self, teams=None, workers: int = None):
+        """
+        Compile every team/committee using a pool of worker processes.
+        Files are named as in the serial mode and reports are written in the same order.
+        :returns: dict[str, float] with the seconds from the submission of the first job of each survey
+                  until its last job finished.
+        """
+        teams = teams or list(self.teams.keys())
+        if workers is None:
+            default = cpu_count() or 1
+            answer = input(f'Number of workers [{default}]: ').strip()
+            workers = int(answer) if answer.isdecimal() and int(answer) > 0 else default
+
+        start = perf_counter()
+        self.out.p_green(f'\nCompiling {len(self.dataframes)} surveys for {len(teams)} teams/committees '
+                         f'using {workers} workers...\n')
+
+        jobs = []
+        submitted = {}  # Survey title -> time its first job was submitted.
+        finished = {}  # Future -> time it finished (set by the pool, results are read in submission order).
+        try:
+            with compile_pool.get_pool(self.dataframes, workers) as pool:
+                for title, survey in self.dataframes.items():
+                    submitted[title] = perf_counter()
+                    for team, columns, team_questions in self.get_team_jobs(title, teams):
+                        output_path = f'{COMPILED_DIR}/{team}_{title.split("/")[-1]}'
+                        future = pool.submit(compile_pool.compile_job, title, columns, output_path)
+                        future.add_done_callback(lambda done: finished.__setitem__(done, perf_counter()))
+                        jobs.append((future, team, title, len(survey) - 1, team_questions))
+
+                # Wait in submission order, so reports are always appended in the same order.
+                for future, team, title, total_responses, team_questions in jobs:
+                    self.out.l_info(f'Compiled CSV saved to {future.result()}.')
+                    self.save_report(team, title, total_responses, team_questions, [])
+        finally:
+            compile_pool.release()  # Also if a job failed, so the surveys are not kept referenced.
+
+        timings = {}
+        for title, first in submitted.items():
+            last = max((finished[future] for future, _, job_title, _, _ in jobs if job_title == title), default=first)
+            timings[title] = round(last - first, 3)
+            self.out.l_info(f'{title} compiled in {timings[title]:.2f} s.')
+
+        self.out.l_info(f'{len(jobs)} files compiled in {perf_counter() - start:.2f} s.')
+        self.out.p_green('All surveys compiled successfully!')
+        return timings
 
-            # Generate report.
-            template = self.jinja.get_template('report.txt.jinja')
+    def get_team_jobs(self, title: str, teams):
+        """
+        Get the columns and questions to compile for each team with at least one question in the survey.
+        Columns of each topic are resolved once and shared by all teams.
+        :returns: list[tuple[str, tuple[int], list[str]]]
+        """
+        with self.out.stage('range resolution'):
+            topic_columns = {topic: self.get_question_columns(title, questions)
+                             for topic, questions in self.questions_by_survey[title].items()}
+
+        jobs = []
+        for team in teams:
+            team_questions = [question for topic in self.team_topics[team]
+                              for question in self.questions_by_survey[title][topic]]
+            if not team_questions:
+                self.out.l_warning(f'No questions to compile for {team} in {title}. Skipped.')
+                continue
+            columns = tuple(column for topic in self.team_topics[team] for column in topic_columns[topic])
+            jobs.append((team, columns, team_questions))
+
+        return jobs
+
+    def get_question_columns(self, title: str, questions) -> list:
+        """
+        Get the column indexes of the given questions, in order.
+        :returns: list[int]
+        """
+        columns = []
+        for question in questions:
+            columns.extend(range(*self.get_question_range(title, question)))
+        return columns
+
+    def save_compiled(self, team: str, title: str, compiled_df, total_responses: int,
+                      team_questions: list, additional_questions: list) -> None:
+        """
+        Save the compiled CSV file and append the survey report to the team report.
+        """
+        filename = f'{team}_{title.split("/")[-1]}'
+        # "Unnamed: ..." is removed from column headers by the writer.
+        with self.out.stage('CSV write', rows=len(compiled_df)):
+            survey_io.write_csv(compiled_df, f'{COMPILED_DIR}/{filename}')
+
+        self.out.l_info(f'Compiled CSV saved to {COMPILED_DIR}/{filename}.')
+        self.save_report(team, title, total_responses, team_questions, additional_questions)
 
+    def save_report(self, team: str, title: str, total_responses: int,
+                    team_questions: list, additional_questions: list) -> None:
+        """
+        Append the survey report to the team report.
+        """
+        filename = f'{team}_{title.split("/")[-1]}'
+        with self.out.stage('report render'):
+            template = self.jinja.get_template('report.txt.jinja')
             report = template.render(date=datetime.now(),
                                      version=self.version,
                                      team=team,
                                      title=title,
                                      filename=filename,
-                                     total_responses=len(survey)-1,
+                                     total_responses=total_responses,
                                      team_questions=team_questions,
                                      additional_questions=additional_questions)
 
-            with open(f'{COMPILED_DIR}/report_{team}.txt', 'a', encoding='utf-8') as f:
-                f.write(report)
-            self.out.l_info(f'Report saved to {COMPILED_DIR}/report_{team}.txt')
-            self.out.p_green(f'{title} compiled successfully!')
-
-        self.out.p_green('All surveys compiled successfully!')
+        with open(f'{COMPILED_DIR}/report_{team}.txt', 'a', encoding='utf-8') as f:
+            f.write(report)
+        self.out.l_info(f'Report saved to {COMPILED_DIR}/report_{team}.txt')
 
     def set_interests(self):
         print(self.get_interests_table())
@@ -332,7 +502,7 @@ class Compiler(builder.BaseModule):
 
     def on_file_change(self, files):
         if self.startup_completed:
-            self.dataframes = Compiler.get_dataframes(files)
+            self.load_surveys(files)
 
     def run(self):
         while self.main_menu.display() != 'back':
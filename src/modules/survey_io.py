@@ -0,0 +1,115 @@
+"""
+Copyright (c) 2022-2023 Nanush7. See LICENSE file.
+
+Survey CSV input/output helpers shared by the modules.
+"""
+import os
+from hashlib import sha256
+from re import sub
+from src.metadata import metadata
+
+
+class SurveyFile:
+    """
+    Lightweight survey file descriptor, used by the modules instead of open file objects.
+    Files are only opened when read, so each reader gets its own independent handle.
+    """
+
+    def __init__(self, file_path: str):
+        self.path = file_path
+
+    @property
+    def name(self) -> str:
+        return self.path
+
+    def __repr__(self):
+        return f'SurveyFile({self.path!r})'
+
+
+def read_survey(file_path: str, dtype=None, usecols=None, chunksize=None):
+    """
+    Read a survey CSV file (memory-mapped).
+    If dtype is str, every cell is loaded as a string and empty cells are kept as '' instead of NaN.
+    usecols selects the columns to parse (see pandas.read_csv).
+    :returns: pandas.DataFrame | iterator of DataFrames if chunksize is given.
+    """
+    import pandas  # Deferred, so the suite starts without importing Pandas.
+    kwargs = {'dtype': str, 'na_filter': False} if dtype is str else {}
+    return pandas.read_csv(file_path, encoding='utf-8', usecols=usecols, chunksize=chunksize,
+                           memory_map=True, **kwargs)
+
+
+def read_header(file_path: str):
+    """
+    Read the column labels of a survey CSV file (as named by Pandas).
+    :returns: pandas.Index
+    """
+    import pandas
+    return pandas.read_csv(file_path, encoding='utf-8', nrows=0).columns
+
+
+def read_rows(file_path: str, columns, offset: int, dtype=None, chunksize: int = 10000):
+    """
+    Read the rows of a survey CSV file that start at a byte offset (which must be a row boundary),
+    labeling the columns with the given labels.
+    :returns: iterator of DataFrames (chunks of chunksize rows).
+    """
+    import pandas
+    if offset >= os.path.getsize(file_path):
+        return
+    kwargs = {'dtype': str, 'na_filter': False} if dtype is str else {}
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        yield from pandas.read_csv(f, encoding='utf-8', header=None, names=list(columns), chunksize=chunksize,
+                                   **kwargs)
+
+
+def file_digest(file_path: str, start: int = 0, end: int = None, digest=None):
+    """
+    Hash the bytes [start, end) of a file, adding them to digest if given.
+    :returns: hashlib sha256 object.
+    """
+    digest = digest or sha256()
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = (end if end is not None else os.path.getsize(file_path)) - start
+        while remaining > 0:
+            block = f.read(min(remaining, 2**20))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest
+
+
+def prefix_fingerprint(file_path: str, end: int, block: int = 2**16) -> str:
+    """
+    Fingerprint of the bytes [0, end) of a file: its length, first block (header and first rows) and last block.
+    Reads at most two blocks, whatever the size of the file.
+    :returns: str (hex digest)
+    """
+    digest = sha256(str(end).encode())
+    file_digest(file_path, 0, min(block, end), digest)
+    file_digest(file_path, max(end - block, 0), end, digest)
+    return digest.hexdigest()
+
+
+def clean_headers(columns) -> list:
+    """
+    Remove "Unnamed: ..." (added by Pandas to columns without a name) from column labels.
+    :returns: list[str]
+    """
+    return [sub(f'({metadata.PANDAS_UNNAMED} )[0-9]+', '', str(label)) for label in columns]
+
+
+def write_csv(df, file_path: str, mode: str = 'w', header: bool = True) -> None:
+    """
+    Write a survey DataFrame to a CSV file with clean headers.
+    Only the header labels are cleaned, data rows are written as they are.
+    """
+    df.to_csv(file_path,
+              sep=',',
+              index=False,
+              encoding='utf-8',
+              mode=mode,
+              header=clean_headers(df.columns) if header else False)
@@ -0,0 +1,246 @@
+"""
+Copyright (c) 2022-2023 Nanush7. See LICENSE file.
+
+WCA token index.
+"""
+import mmap
+import os
+import struct
+from hashlib import sha256
+import numpy
+import pandas
+
+
+class TokenIndex:
+    """
+    Hashed set of valid WCA tokens.
+    Membership checks take constant time, no matter how many tokens were issued.
+    """
+
+    def __init__(self, tokens=()):
+        self._tokens = frozenset(tokens)
+
+    @classmethod
+    def from_file(cls, file_path: str):
+        """
+        Build the index from a tokens file (one token per line).
+        """
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return cls(f.read().split('\n'))
+
+    def isin(self, values):
+        """
+        Vectorized membership check, one set lookup per value
+        (Series.isin would build a hash table of all the tokens on every call).
+
+        :param values: pandas.Series of tokens.
+        :returns: pandas.Series of booleans.
+        """
+        tokens = self._tokens
+        return pandas.Series([value in tokens for value in values.to_numpy()], index=values.index, dtype=bool)
+
+    def __contains__(self, token) -> bool:
+        return token in self._tokens
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def __iter__(self):
+        return iter(self._tokens)
+
+
+class CompiledTokenIndex:
+    """
+    Sorted array of 32-byte token digests (the 64-character hex tokens decoded), memory-mapped from disk.
+    The index is compiled once and stored next to the tokens file. It is compiled again if the content
+    of the tokens file changes.
+
+    Index file layout: MAGIC, sha256 of the tokens file, number of tokens, number of skipped lines
+    (padded to HEADER_SIZE bytes) and the sorted digests.
+    """
+    MAGIC = b'WACTIDX1'
+    HEADER = struct.Struct('<8s32sQQ')
+    HEADER_SIZE = 64
+    DIGEST_SIZE = 32
+    EXTENSION = '.idx'
+    # Used when the index cannot be stored next to the tokens file (e.g. read-only directories).
+    CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'wac-survey-suite')
+
+    def __init__(self, index_path: str):
+        with open(index_path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _, self.source_hash, count, self.skipped = CompiledTokenIndex.HEADER.unpack_from(self._mmap)
+        self._digests = numpy.frombuffer(self._mmap, dtype=f'S{self.DIGEST_SIZE}',
+                                         count=count, offset=self.HEADER_SIZE)
+        # First 8 bytes of each digest as integers (also sorted), searched much faster than the digests.
+        self._prefixes = CompiledTokenIndex.prefixes(self._digests)
+        self.cache_hit = True
+
+    @classmethod
+    def load(cls, tokens_path: str):
+        """
+        Load the index of a tokens file, compiling it first if there is no valid cached index.
+        If the index cannot be stored next to the tokens file, it is stored in CACHE_DIR, named by the hash
+        of the tokens file (so later runs use it too).
+        """
+        index_path = tokens_path + cls.EXTENSION
+        source_hash = cls.file_hash(tokens_path)
+        cache_path = os.path.join(cls.CACHE_DIR, source_hash.hex() + cls.EXTENSION)
+
+        for path in (index_path, cache_path):
+            if cls.cached_hash(path) == source_hash:
+                return cls(path)
+
+        try:
+            cls.compile(tokens_path, index_path, source_hash)
+        except OSError:
+            os.makedirs(cls.CACHE_DIR, exist_ok=True)
+            index_path = cache_path
+            cls.compile(tokens_path, index_path, source_hash)
+        index = cls(index_path)
+        index.cache_hit = False
+        return index
+
+    @classmethod
+    def compile(cls, tokens_path: str, index_path: str, source_hash: bytes) -> None:
+        """
+        Write the index of a tokens file.
+        Lines that are not 64-character lowercase hex tokens are skipped.
+        """
+        digests = set()
+        skipped = 0
+        with open(tokens_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                digest = cls.digest(line.strip())
+                if digest is not None:
+                    digests.add(digest)
+                elif line.strip():
+                    skipped += 1
+
+        # Write to a temporary file first, so a half-written index is never used.
+        temp_path = index_path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(cls.HEADER.pack(cls.MAGIC, source_hash, len(digests), skipped).ljust(cls.HEADER_SIZE, b'\0'))
+                f.write(b''.join(sorted(digests)))
+            os.replace(temp_path, index_path)
+        except OSError:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @staticmethod
+    def file_hash(file_path: str) -> bytes:
+        """
+        sha256 digest of the file content.
+        """
+        file_hash = sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                file_hash.update(block)
+        return file_hash.digest()
+
+    @classmethod
+    def cached_hash(cls, index_path: str):
+        """
+        Source hash stored in an index file, or None if there is no valid index.
+        """
+        try:
+            with open(index_path, 'rb') as f:
+                header = f.read(cls.HEADER.size)
+        except OSError:
+            return None
+        if len(header) != cls.HEADER.size:
+            return None
+        magic, source_hash, _, _ = cls.HEADER.unpack(header)
+        return source_hash if magic == cls.MAGIC else None
+
+    @classmethod
+    def digest(cls, token):
+        """
+        Decode a 64-character lowercase hex token.
+        :returns: bytes | None if the value is not a token.
+        """
+        if not isinstance(token, str) or len(token) != 2 * cls.DIGEST_SIZE or token != token.lower():
+            return None
+        try:
+            digest = bytes.fromhex(token)
+        except ValueError:
+            return None
+        return digest if len(digest) == cls.DIGEST_SIZE else None
+
+    def isin(self, values):
+        """
+        Vectorized membership check (binary search on the sorted digests).
+
+        :param values: pandas.Series of tokens.
+        :returns: pandas.Series of booleans.
+        """
+        return pandas.Series(self._lookup(values), index=values.index)
+
+    def _lookup(self, values):
+        """
+        The well-formed tokens are decoded at once and searched by their first 8 bytes (with sorted queries).
+        :returns: numpy.ndarray of booleans.
+        """
+        found, queries = CompiledTokenIndex.decode(values)
+        if not len(self._digests) or not len(queries):
+            return numpy.zeros(len(values), dtype=bool)
+
+        query_prefixes = CompiledTokenIndex.prefixes(queries)
+        order = numpy.argsort(query_prefixes)
+        positions = numpy.empty(len(queries), dtype=numpy.intp)
+        positions[order] = numpy.searchsorted(self._prefixes, query_prefixes[order])
+        positions = numpy.minimum(positions, len(self._digests) - 1)
+
+        # Compare whole arrays, numpy strips trailing null bytes from single elements.
+        matches = self._digests[positions] == queries
+        # Digests that share their first 8 bytes with another one: search the whole digest.
+        shared = ~matches & (self._prefixes[positions] == query_prefixes)
+        if shared.any():
+            exact = numpy.minimum(numpy.searchsorted(self._digests, queries[shared]), len(self._digests) - 1)
+            matches[shared] = self._digests[exact] == queries[shared]
+        found[found] = matches
+        return found
+
+    @classmethod
+    def decode(cls, values):
+        """
+        Decode the 64-character lowercase hex tokens of a Series with a single bytes.fromhex call.
+        If every value of that length is a token (the usual case), no regular expression is needed.
+        :returns: (numpy.ndarray of booleans, the values that are tokens; numpy.ndarray of their digests)
+        """
+        if values.dtype == object:
+            values = values.astype(str)  # Other values (e.g. None) become strings that are not tokens.
+        size = 2 * cls.DIGEST_SIZE
+        found = values.str.len().to_numpy(dtype=float, na_value=0) == size
+        joined = ''.join(values[found].tolist())
+        decoded = None
+        if not any(letter in joined for letter in 'ABCDEF'):
+            try:
+                decoded = bytes.fromhex(joined)
+            except ValueError:
+                pass
+        # fromhex skips whitespace, a token with spaces decodes to fewer bytes.
+        if decoded is None or len(decoded) != len(joined) // 2:
+            found = values.str.fullmatch(f'[0-9a-f]{{{size}}}', na=False).to_numpy(dtype=bool)
+            decoded = bytes.fromhex(''.join(values[found].tolist()))
+        return found.copy(), numpy.frombuffer(decoded, dtype=f'S{cls.DIGEST_SIZE}')
+
+    @classmethod
+    def prefixes(cls, digests):
+        """
+        :returns: numpy.ndarray of the first 8 bytes of each digest, as unsigned integers.
+        """
+        words = numpy.frombuffer(digests.tobytes(), dtype='>u8').reshape(-1, cls.DIGEST_SIZE // 8)
+        return words[:, 0].astype(numpy.uint64)
+
+    def __contains__(self, token) -> bool:
+        return bool(self._lookup(pandas.Series([token], dtype=object))[0])
+
+    def __len__(self) -> int:
+        return len(self._digests)
+
+    def close(self) -> None:
+        self._digests = self._digests[:0].copy()
+        self._mmap.close()
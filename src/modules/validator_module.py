@@ -1,10 +1,14 @@
 """
 Copyright (c) 2022-2023 Nanush7. See LICENSE file.
 """
+import json
 import pandas
-from os import path, makedirs
-from re import sub
-from src.modules import builder
+from functools import partial
+from os import path, makedirs, replace
+from time import perf_counter
+from src.log import resident_memory
+from src.modules import builder, survey_io
+from src.modules.tokens import TokenIndex, CompiledTokenIndex
 
 
 class Validator(builder.BaseModule):
@@ -15,8 +19,11 @@ class Validator(builder.BaseModule):
     WCA_TOKEN_LEN = 64
     DATE_FIELD = 'Start Date'
     # DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
-    MAX_COLUMNS = 400  # FIXME.
     VALIDATED_DIR = 'Validated'
+    MODES = {'1': 'delete', '2': 'list', '3': 'stream', '4': 'incremental'}  # Menu option -> validation mode.
+    CHUNK_SIZE = 10000  # Rows per chunk in streaming mode.
+    LOG_SAMPLE = 10  # Invalid responses logged one by one, the rest are summarized.
+    CHECKPOINT_VERSION = 2  # Format of the incremental mode checkpoints.
 
     def __init__(self, **kwargs):
         # Add anything you want here.
@@ -28,24 +35,21 @@ class Validator(builder.BaseModule):
 
         # Stats and other data.
         self.tokens_path = None
-        self.token_list = []
+        self.token_index = TokenIndex()
         self.list_only = False
         self.total_responses = 0
         self.deleted = 0
         self.to_delete = []
         self.dataframes = {}
         self.bad_token_column = None
+        self.last_response = (None, None)  # ID and date of the last response read in streaming mode.
 
         # Menu.
         self.main_menu = builder.Menu(extra_start=f'\n{self.name} module v{self.version} by {self.authors}.\n',
                                       back_option=True)
 
     def startup(self):
-        # Survey responses.
-        # Load data as string to avoid Pandas adding floating points.
-
-        # Pandas DataFrames.
-        self.dataframes = Validator.get_dataframes(self.files)
+        # Survey responses are loaded on each run, parsing only the columns the selected mode needs.
 
         # Tokens.
         self.out.p_blue('Use Ctrl-C to abort setup.')
@@ -59,12 +63,15 @@ class Validator(builder.BaseModule):
         except KeyboardInterrupt:
             return False
 
-        with open(self.tokens_path, 'r', encoding='utf-8') as f:
-            self.token_list = f.read().split('\n')
+        self.load_tokens()
 
         # Build menu.
         self.main_menu.add_numbered_option('Delete invalid responses from original CSV file.')
         self.main_menu.add_numbered_option('List responses to delete.')
+        self.main_menu.add_numbered_option('Delete invalid responses from original CSV file (streaming, for large '
+                                           'surveys).')
+        self.main_menu.add_numbered_option('Delete invalid responses, only checking the responses added since the '
+                                           'last run (incremental).')
 
         # Create CSV output directory.
         if not path.exists(self.VALIDATED_DIR):
@@ -72,22 +79,59 @@ class Validator(builder.BaseModule):
 
         return True
 
-    @staticmethod
-    def get_dataframes(files):
+    def load_tokens(self) -> None:
+        """
+        Load the compiled index of the tokens file, compiling it if the tokens file changed.
+        Reports load time and resident memory before and after loading (if it can be read, see log.resident_memory).
+        """
+        rss_before = resident_memory()
+        start = perf_counter()
+        self.token_index = CompiledTokenIndex.load(self.tokens_path)
+        elapsed = (perf_counter() - start) * 1000
+        rss_after = resident_memory()
+
+        source = 'cached index' if self.token_index.cache_hit else 'tokens file (index compiled)'
+        memory = f' (RSS {rss_before} MB -> {rss_after} MB)' if rss_before is not None else ''
+        self.out.l_info(f'{len(self.token_index)} tokens loaded from {source} in {elapsed:.0f} ms{memory}.')
+        if self.token_index.skipped:
+            self.out.l_warning(f'{self.token_index.skipped} lines in the tokens file are not valid tokens. Skipped.')
+
+    def get_dataframes(self, files, projected: bool = False):
         """
         Get list of Pandas DataFrames for each file in self.file.
+        Load data as string to avoid Pandas adding floating points.
+        If projected is True, only the columns needed by list mode are parsed.
         """
         df = {}
         for file in files:
-            df[file.name] = pandas.read_csv(file,
-                                            encoding='utf-8',
-                                            converters={i: str for i in range(Validator.MAX_COLUMNS)})
+            usecols = Validator.get_list_columns(file.name) if projected else None
+            with self.out.stage('load') as stage:
+                df[file.name] = self.store.read(file.name, dtype=str, usecols=usecols)
+                stage.rows = len(df[file.name])
 
         return df
 
+    @staticmethod
+    def get_list_columns(file_path: str):
+        """
+        Get the position of the columns used in list mode: ID, token and the last (bad token) column.
+        :returns: list[int]
+        """
+        header = survey_io.read_header(file_path)
+        return sorted({header.get_loc(Validator.ID_FIELD),
+                       header.get_loc(Validator.WCA_TOKEN_FIELD),
+                       len(header) - 1})
+
+    @staticmethod
+    def get_output_path(file_path: str) -> str:
+        """
+        Path of the validated copy of a survey.
+        """
+        return f'{Validator.VALIDATED_DIR}/Validated_{file_path.split("/")[-1]}'
+
     def on_file_change(self, files):
-        if self.startup_completed:
-            self.dataframes = Validator.get_dataframes(files)
+        # Surveys will be loaded again on the next run.
+        self.dataframes = {}
 
     def run(self) -> None:
         while True:
@@ -96,44 +140,71 @@ class Validator(builder.BaseModule):
                 break
 
             # Run option.
-            if choice == '1':
-                for survey in self.dataframes:
-                    self.out.l_info(f'Validating {survey}...')
-                    self.run_delete(survey)
-                    self.out.l_info(f'Deleted {self.deleted} out of {self.total_responses} responses.')
-            elif choice == '2':
-                for survey in self.dataframes:
-                    self.out.l_info(f'Validating {survey}...')
-                    self.run_list(survey)
-                    self.out.l_info(f'Deleted {self.deleted} out of {self.total_responses} responses.')
+            if choice in self.MODES:
+                self.validate_all(self.MODES[choice])
+
+    def validate_all(self, mode: str, write: bool = True):
+        """
+        Validate every survey without prompting.
+        mode: 'delete', 'list', 'stream' or 'incremental'.
+        write: in delete mode, write the validated surveys (otherwise they are only kept in self.dataframes).
+        :returns: list[dict] with the stats of each survey.
+        """
+        if mode in ('stream', 'incremental'):
+            self.dataframes = {}
+            run = self.run_stream if mode == 'stream' else self.run_incremental
+            jobs = [(file.name, run, file) for file in self.files]
+        else:
+            self.dataframes = self.get_dataframes(self.files, projected=mode == 'list')
+            run = partial(self.run_delete, write=write) if mode == 'delete' else self.run_list
+            jobs = [(survey, run, survey) for survey in self.dataframes]
+
+        stats = []
+        for survey, run, target in jobs:
+            self.out.l_info(f'Validating {survey}...')
+            start = perf_counter()
+            run(target)
+            self.out.l_info(f'Deleted {self.deleted} out of {self.total_responses} responses.')
+            stats.append({'survey': survey,
+                          'responses': self.total_responses,
+                          'deleted': self.deleted,
+                          'seconds': round(perf_counter() - start, 3)})
+
+        return stats
 
     def prepare_run(self, survey):
         # Reset some attributes on each run.
         self.total_responses = len(self.dataframes[survey]) - 1
         self.deleted = 0
         self.to_delete = []
-        self.bad_token_column = self.dataframes[survey].columns[-1]
+        self.set_bad_token_column(self.dataframes[survey].columns)
+
+    def set_bad_token_column(self, columns) -> None:
+        self.bad_token_column = columns[-1]
         if 'Unnamed' not in self.bad_token_column:
             self.bad_token_column = None
         else:
             self.out.l_warning('Bad Token Column found.')
 
-    def run_delete(self, survey):
+    def run_delete(self, survey, write: bool = True):
         """
         The script will run in deletion mode. A clean copy of the CSV file will be generated.
+        The validated survey is also left in self.dataframes. If write is False, the CSV file is not written.
         """
         self.prepare_run(survey)
 
-        output_path = f'{self.VALIDATED_DIR}/Validated_{survey.split("/")[-1]}'
+        output_path = self.get_output_path(survey)
 
         self.out.l_info('Fixing columns...')
         if self.bad_token_column:
-            self.fix_token_position(survey)
+            with self.out.stage('token relocation', rows=self.total_responses):
+                self.fix_token_position(self.dataframes[survey])
 
         # Delete responses with duplicated tokens.
         self.out.l_info('Checking responses with duplicated tokens...')
         previous_amount = len(self.dataframes[survey])
-        self.delete_older_duplicates(survey, False)
+        with self.out.stage('duplicates', rows=self.total_responses):
+            self.delete_older_duplicates(survey, False)
         new_amount = len(self.dataframes[survey])
         duplicates_deleted = previous_amount - new_amount
         self.deleted += duplicates_deleted
@@ -141,16 +212,12 @@ class Validator(builder.BaseModule):
 
         self.out.l_info('Validating responses...')
 
-        for index, row in self.dataframes[survey].iloc[1:].iterrows():
-            token = row[self.WCA_TOKEN_FIELD].strip()
-
-            # Delete responses with invalid tokens.
-            if not self.is_valid(token) or not token:
-                self.out.l_info(f'#{index} >> Invalid token')
-                self._delete(survey, index)
-                continue
-
-            self.out.l_verbose(f'#{index} >> OK')
+        # Delete responses with invalid tokens.
+        with self.out.stage('token check', rows=self.total_responses):
+            invalid = self.invalid_mask(self.dataframes[survey])
+        self.log_invalid(invalid)
+        self.dataframes[survey] = self.dataframes[survey][~invalid]
+        self.deleted += int(invalid.sum())
 
         # Remove bad_token_column from dataframe.
         if self.bad_token_column:
@@ -159,13 +226,167 @@ class Validator(builder.BaseModule):
             self.dataframes[survey].drop([self.bad_token_column], axis=1)
 
         # Write data to csv file.
-        self.dataframes[survey].to_csv(output_path, sep=',', index=False, encoding='utf-8')
+        # Pandas adds "Unnamed: ..." to columns without a name, the writer removes that from the headers.
+        if write:
+            with self.out.stage('CSV write', rows=len(self.dataframes[survey])):
+                survey_io.write_csv(self.dataframes[survey], output_path)
+            self.out.l_info(f'File saved as {output_path}.')
+
+    def run_stream(self, file, checkpoint: dict = None, incremental: bool = False):
+        """
+        The script will run in deletion mode, reading the CSV file in chunks of CHUNK_SIZE rows.
+        Only the token index and the tokens already kept stay in memory.
+        The output is the same as run_delete.
+        If a checkpoint is given (see run_incremental), only the rows after it are validated and appended.
+        If incremental is True, the ID and date of the last response are kept in last_response.
+
+        :returns: set of the tokens kept.
+        """
+        output_path = self.get_output_path(file.name)
+
+        columns = survey_io.read_header(file.name)
+        self.total_responses = -1  # Sub-headers row.
+        self.deleted = 0
+        self.set_bad_token_column(columns)
+
+        if checkpoint:
+            seen = set(checkpoint['seen'])
+            first_chunk = False
+            self.total_responses = checkpoint['rows'] - 1
+            self.deleted = checkpoint['deleted']
+            chunks = survey_io.read_rows(file.name, columns, checkpoint['offset'], dtype=str,
+                                         chunksize=self.CHUNK_SIZE)
+        else:
+            seen = set()
+            first_chunk = True
+            chunks = survey_io.read_survey(file.name, dtype=str, chunksize=self.CHUNK_SIZE)
+        for chunk in chunks:
+            # Keep the row labels of a full read (label 0 is the sub-headers row).
+            chunk.index += self.total_responses + 1
+            if incremental and len(chunk):
+                # Only used in the log messages, surveys without these columns can be validated too.
+                last = chunk.iloc[-1]
+                self.last_response = (last.get(self.ID_FIELD), last.get(self.DATE_FIELD))
+            with self.out.stage('chunk validation', rows=len(chunk)):
+                keep = self.validate_chunk(chunk, seen)
+            with self.out.stage('CSV write', rows=int(keep.sum())):
+                survey_io.write_csv(chunk[keep], output_path, mode='w' if first_chunk else 'a', header=first_chunk)
+            first_chunk = False
+            self.total_responses += len(chunk)
+            self.deleted += int((~keep).sum())
+            self.out.l_verbose(f'{self.total_responses + 1} rows processed.')
+
+        if first_chunk:  # No responses at all, write the headers only.
+            survey_io.write_csv(pandas.DataFrame(columns=columns), output_path)
+            self.total_responses = 0
+
         self.out.l_info(f'File saved as {output_path}.')
+        return seen
+
+    def run_incremental(self, file):
+        """
+        The script will run in streaming deletion mode, validating only the responses appended to the CSV file
+        since the last run and appending the valid ones to the validated file.
+        The last run is recorded in a checkpoint next to the validated file. Everything is validated again
+        if the checkpoint does not match (the already validated part of the file, the tokens file or the
+        validated file changed).
+        """
+        output_path = self.get_output_path(file.name)
+        checkpoint_path = f'{output_path}.checkpoint.json'
+        size = path.getsize(file.name)
+
+        checkpoint = self.load_checkpoint(checkpoint_path, file.name, output_path)
+        if checkpoint:
+            self.out.l_info(f'Resuming after response {checkpoint["last_id"]} ({checkpoint["last_date"]}).')
+            self.last_response = (checkpoint['last_id'], checkpoint['last_date'])
+        else:
+            self.last_response = (None, None)
+        validated = checkpoint['rows'] - 1 if checkpoint else 0
+
+        seen = self.run_stream(file, checkpoint, incremental=True)
+        self.out.l_info(f'{self.total_responses - validated} new responses validated.')
+
+        # The next run starts where this one ended, which must be a row boundary.
+        with open(file.name, 'rb') as f:
+            f.seek(max(size - 1, 0))
+            last_byte = f.read(1)
+        if path.getsize(file.name) != size or last_byte != b'\n':
+            self.out.l_warning(f'{file.name} changed while validating or does not end with a new line. '
+                               f'Checkpoint not saved.')
+            return
+
+        self.save_checkpoint(checkpoint_path, {
+            'version': self.CHECKPOINT_VERSION,
+            'offset': size,
+            'prefix_hash': survey_io.prefix_fingerprint(file.name, size),
+            'rows': self.total_responses + 1,
+            'deleted': self.deleted,
+            'last_id': self.last_response[0],
+            'last_date': self.last_response[1],
+            'tokens_hash': self.token_index.source_hash.hex(),
+            'output_size': path.getsize(output_path),
+            'seen': list(seen)
+        })
+
+    def load_checkpoint(self, checkpoint_path: str, file_path: str, output_path: str):
+        """
+        Load the checkpoint of the last incremental run, if it is still valid for the survey file.
+        The part of the file validated in the last run is checked with a fingerprint of its length, first and
+        last blocks (see survey_io.prefix_fingerprint), so the check costs the same for any survey size.
+        Rows added or removed anywhere change the last block. An edit in the middle of the file that keeps its
+        length is not detected, run delete mode to validate everything again after such changes.
+        :returns: dict | None
+        """
+        if not path.isfile(checkpoint_path):
+            return None
+        try:
+            with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            self.out.l_warning('Checkpoint could not be read. Validating all responses...')
+            return None
+
+        if checkpoint.get('version') != self.CHECKPOINT_VERSION:
+            reason = 'it was saved by another version'
+        elif checkpoint['tokens_hash'] != self.token_index.source_hash.hex():
+            reason = 'the tokens file changed'
+        elif not path.isfile(output_path) or path.getsize(output_path) != checkpoint['output_size']:
+            reason = 'the validated file changed'
+        elif path.getsize(file_path) < checkpoint['offset']:
+            reason = 'the survey file is shorter'
+        else:
+            if survey_io.prefix_fingerprint(file_path, checkpoint['offset']) == checkpoint['prefix_hash']:
+                return checkpoint
+            reason = 'the survey file changed'
+
+        self.out.l_info(f'Checkpoint not used ({reason}). Validating all responses...')
+        return None
+
+    @staticmethod
+    def save_checkpoint(checkpoint_path: str, checkpoint: dict) -> None:
+        # Written to a temporary file first, so a failed write does not leave a broken checkpoint.
+        with open(checkpoint_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        replace(checkpoint_path + '.tmp', checkpoint_path)
 
-        # Pandas adds "Unnamed: ..." to columns without a name.
-        # We have to remove that.
-        self.out.l_info('Fixing headers...')
-        Validator.fix_headers(output_path)
+    def validate_chunk(self, chunk, seen: set):
+        """
+        Validate a chunk of responses.
+        A response is kept if its token was not seen before (older duplicates are deleted) and is valid.
+        Kept tokens are added to seen.
+
+        :returns: pandas.Series (True for the responses to keep).
+        """
+        if self.bad_token_column:
+            self.fix_token_position(chunk)
+
+        tokens = chunk[self.WCA_TOKEN_FIELD]
+        # Checked against the set itself: isin would hash all the seen tokens again for every chunk.
+        seen_before = pandas.Series([token in seen for token in tokens.to_numpy()], index=tokens.index, dtype=bool)
+        duplicates = tokens.duplicated(keep='first') | seen_before
+        keep = ~(duplicates | self.invalid_mask(chunk))
+        seen.update(tokens[keep])
+        return keep
 
     def run_list(self, survey):
         """
@@ -177,48 +398,65 @@ class Validator(builder.BaseModule):
 
         self.out.l_info('Fixing columns...')
         if self.bad_token_column:
-            self.fix_token_position(survey)
+            with self.out.stage('token relocation', rows=self.total_responses):
+                self.fix_token_position(self.dataframes[survey])
 
         # List responses with duplicated tokens.
         self.out.l_info('Checking responses with duplicated tokens...')
-        duplicates = self.delete_older_duplicates(survey, True)
-        self.to_delete = self.dataframes[survey][duplicates][self.ID_FIELD].to_list()
-        self.out.l_info(f'Found {len(self.to_delete)} duplicates.')
+        with self.out.stage('duplicates', rows=self.total_responses):
+            duplicates = self.delete_older_duplicates(survey, True)
+        self.out.l_info(f'Found {int(duplicates.sum())} duplicates.')
 
         self.out.l_info('Validating responses...')
 
-        for index, row in self.dataframes[survey].iloc[1:].iterrows():
-            token = row[self.WCA_TOKEN_FIELD].strip()
-
-            # Check responses with invalid tokens.
-            if not self.is_valid(token) or not token:
-                if token:
-                    self.out.l_info(f'#{index} >> Invalid token')
-                self.to_delete.append(self.dataframes[survey][self.ID_FIELD].iloc[index])
-                continue
-
-            self.out.l_verbose(f'#{index} >> OK')
+        # Check responses with invalid tokens.
+        with self.out.stage('token check', rows=self.total_responses):
+            invalid = self.invalid_mask(self.dataframes[survey])
+        self.log_invalid(invalid)
 
         # Check bad_token_column.
         if self.bad_token_column and not self.dataframes[survey][self.bad_token_column].empty:
             self.out.l_warning('bad_token_column is not empty.')
 
         # Empty token fields are detected as duplicates and invalid tokens.
-        # Remove the duplicates.
-        clean_to_delete = [elem for index, elem in enumerate(self.to_delete) if elem not in self.to_delete[:index]]
+        # Keep each ID once, in the order it appears in the survey.
+        ids = self.dataframes[survey].loc[duplicates | invalid, self.ID_FIELD]
+        self.to_delete = ids.drop_duplicates().to_list()
 
-        with open(output_path, 'w', encoding='utf-8') as f:
-            for elem in clean_to_delete:
+        with self.out.stage('list write', rows=len(self.to_delete)), open(output_path, 'w', encoding='utf-8') as f:
+            for elem in self.to_delete:
                 f.write(elem + '\n')
         self.out.l_info(f'File saved as {output_path}.')
 
-        self.deleted = len(clean_to_delete)
+        self.deleted = len(self.to_delete)
 
     def is_valid(self, token: str) -> bool:
         """
         Check if the token is valid and delete the response if not.
         """
-        return token in self.token_list
+        return token in self.token_index
+
+    def invalid_mask(self, df):
+        """
+        Flag responses with an empty or invalid token.
+        The first row (index 0) holds the sub-headers, so it is never flagged.
+
+        :returns: pandas.Series
+        """
+        tokens = df[self.WCA_TOKEN_FIELD].str.strip()
+        invalid = ~self.token_index.isin(tokens) | (tokens == '')
+        if 0 in invalid.index:
+            invalid.loc[0] = False
+        return invalid
+
+    def log_invalid(self, invalid) -> None:
+        """
+        Log a sample of the responses with invalid tokens and a summary of the rest.
+        """
+        indexes = invalid.index[invalid]
+        with self.out.l_rows('invalid tokens', sample=self.LOG_SAMPLE) as rows:
+            rows.add_all('#%s >> Invalid token', indexes)
+        self.out.l_verbose(f'{len(invalid) - 1 - len(indexes)} responses OK.')
 
     def delete_older_duplicates(self, survey, list_only: bool = False):
         """
@@ -233,33 +471,17 @@ class Validator(builder.BaseModule):
         self.dataframes[survey].drop_duplicates(subset=[self.WCA_TOKEN_FIELD],
                                                 keep='first', ignore_index=False, inplace=True)
 
-    def fix_token_position(self, survey):
+    def fix_token_position(self, df):
         """
         Fix tokens placed in an incorrect column.
         """
-        for index, row in self.dataframes[survey].iloc[1:].iterrows():
-            token = row[self.WCA_TOKEN_FIELD].strip()
-            if not token and len(row[self.bad_token_column]) == self.WCA_TOKEN_LEN:
-                row[self.WCA_TOKEN_FIELD] = row[self.bad_token_column].strip()
-
-    def _delete(self, survey, index: int) -> None:
-        """
-        Delete dataframe row.
-        """
-        self.out.l_verbose(f'#{index} >> deleted')
-        self.dataframes[survey].drop(index, axis=0, inplace=True)
-        self.deleted += 1
-
-    @staticmethod
-    def fix_headers(file_path: str) -> None:
-        """
-        Remove "Unnamed: ..." from column headers.
-        """
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        content = sub(r'(Unnamed: )[0-9]+', '', content)
-
-        # Write fixed content.
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        misplaced = (df[self.WCA_TOKEN_FIELD].str.strip() == '') & \
+                    (df[self.bad_token_column].str.len() == self.WCA_TOKEN_LEN)
+        if 0 in misplaced.index:
+            misplaced.loc[0] = False  # Sub-headers row.
+        df.loc[misplaced, self.WCA_TOKEN_FIELD] = df.loc[misplaced, self.bad_token_column].str.strip()
+        self.out.l_verbose(f'{int(misplaced.sum())} tokens moved to {self.WCA_TOKEN_FIELD}.')
+
+    def close(self) -> None:
+        if isinstance(self.token_index, CompiledTokenIndex):
+            self.token_index.close()
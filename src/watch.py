@@ -0,0 +1,186 @@
+"""
+Copyright (c) 2022-2023 Nanush7. See LICENSE file.
+
+Watch mode: process survey exports as they land in (or change in) the surveys directory.
+"""
+import json
+import os
+import threading
+from queue import Queue
+from time import monotonic
+from src.modules import survey_io
+
+
+class Watcher:
+    """
+    Poll a directory for new or changed CSV files and process them in a background worker thread.
+
+    A file is processed once it stops changing (same size and modification time for `debounce` seconds),
+    and only if its content changed since it was last processed: files that were only touched are skipped.
+    Polls only stat the files, their content is hashed when their stats change.
+    Files that could not be processed are processed again on the next poll.
+
+    process: function called by the worker with the list of file paths to process.
+    state_path: JSON file where the processed files are recorded, so unchanged files are not processed
+                (or hashed) again when the watcher is restarted.
+    """
+    STATE_VERSION = 1
+
+    def __init__(self, cli, process, interval: float = 2.0, debounce: float = 1.0, state_path: str = None):
+        self.cli = cli
+        self.out = cli.out
+        self.process = process
+        self.interval = interval
+        self.debounce = debounce
+        self.state_path = state_path
+        self.stats = {}  # File path -> (size, modification time) when last checked.
+        self.fingerprints = {}  # File path -> ((size, modification time), content hash) when last processed.
+        self.pending = {}  # File path -> ((size, modification time), monotonic time first seen).
+        self.results = []
+        self.jobs = Queue()  # (file paths, {file path: fingerprint}) to process.
+        self.finished = Queue()  # (file paths, {file path: fingerprint}, processed), read by poll.
+        self.stop_event = threading.Event()
+        self.worker = None
+        self.load_state()
+
+    def load_state(self) -> None:
+        """
+        Load the files processed by previous runs. Files whose stats did not change since then are not checked.
+        """
+        if not self.state_path or not os.path.isfile(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            self.out.l_warning('Watch state could not be read. Checking all files...')
+            return
+        if state.get('version') != self.STATE_VERSION:
+            return
+        for file_path, (size, mtime, fingerprint) in state['files'].items():
+            self.stats[file_path] = (size, mtime)
+            self.fingerprints[file_path] = ((size, mtime), fingerprint)
+
+    def save_state(self) -> None:
+        if not self.state_path:
+            return
+        files = {file_path: [*key, fingerprint] for file_path, (key, fingerprint) in self.fingerprints.items()}
+        state = {'version': self.STATE_VERSION, 'files': files}
+        directory = os.path.dirname(self.state_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Written to a temporary file first, so a failed write does not leave a broken state.
+        with open(self.state_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def poll(self) -> dict:
+        """
+        Check the directory.
+        :returns: dict of the files that changed (and stopped changing) since they were last processed
+                  and their fingerprints ((size, modification time), content hash).
+        """
+        changed = self._record_finished()
+        now = monotonic()
+        found = set()
+        ready = {}
+        for file_path in self.cli.list_surveys(self.cli.directory):
+            found.add(file_path)
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:  # Removed since it was listed.
+                continue
+            key = (stat.st_size, stat.st_mtime_ns)
+            if self.stats.get(file_path) == key:
+                continue
+
+            # Wait until the file stops changing (it may still be being written).
+            pending = self.pending.get(file_path)
+            if pending is None or pending[0] != key:
+                self.pending[file_path] = (key, now)
+                continue
+            if now - pending[1] < self.debounce:
+                continue
+            del self.pending[file_path]
+            self.stats[file_path] = key
+
+            fingerprint = survey_io.file_digest(file_path).hexdigest()
+            previous = self.fingerprints.get(file_path)
+            if previous and previous[1] == fingerprint:
+                self.out.l_verbose(f'{file_path} did not change. Skipped.')
+                self.fingerprints[file_path] = (key, fingerprint)  # Not hashed again after a restart.
+                changed = True
+                continue
+            ready[file_path] = (key, fingerprint)
+
+        # Forget removed files.
+        for file_path in set(self.stats) - found:
+            del self.stats[file_path]
+            changed = self.fingerprints.pop(file_path, None) is not None or changed
+        for file_path in set(self.pending) - found:
+            del self.pending[file_path]
+
+        if changed:
+            self.save_state()
+        return ready
+
+    def _record_finished(self) -> bool:
+        """
+        Record the fingerprints of the files processed by the worker, and forget the stats of the files
+        that failed so they are processed again.
+        :returns: True if a fingerprint was recorded.
+        """
+        recorded = False
+        while not self.finished.empty():
+            files, fingerprints, processed = self.finished.get()
+            for file_path in files:
+                if processed:
+                    if file_path in self.stats:  # Not removed since.
+                        self.fingerprints[file_path] = fingerprints[file_path]
+                        recorded = True
+                else:
+                    self.stats.pop(file_path, None)
+        return recorded
+
+    def _work(self) -> None:
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            files, fingerprints = job
+            self.out.l_info(f'Processing {", ".join(files)}...')
+            try:
+                self.results.append(self.process(files))
+                processed = True
+            except Exception as exc:
+                message = getattr(exc, 'message', None) or f'{type(exc).__name__}: {exc}'
+                self.out.l_error(message)
+                self.results.append({'surveys': files, 'status': 'error', 'error': message})
+                processed = False
+            self.finished.put((files, fingerprints, processed))
+
+    def run(self) -> list:
+        """
+        Watch until stop() is called or Ctrl-C is pressed. The file being processed is finished before returning.
+        :returns: list of the results returned by process.
+        """
+        self.worker = threading.Thread(target=self._work, name='watch-worker', daemon=True)
+        self.worker.start()
+        self.out.l_info(f'Watching {self.cli.directory} (every {self.interval} s). Use Ctrl-C to stop.')
+        try:
+            while True:
+                ready = self.poll()
+                if ready:
+                    self.jobs.put((list(ready), ready))
+                if self.stop_event.wait(self.interval):
+                    break
+        except KeyboardInterrupt:
+            self.out.l_info('Stopping, waiting for the files being processed...')
+        self.jobs.put(None)
+        self.worker.join()
+        if self._record_finished():
+            self.save_state()
+        return self.results
+
+    def stop(self) -> None:
+        self.stop_event.set()